@@ -0,0 +1,261 @@
+"""
+Офлайн-бенчмарк парсера: записанные страницы магазинов отдаются локальным HTTP-сервером,
+по ним гоняется get_product_info, а на выходе — JSON с задержками (p50/p95), вызовами в браузер,
+трафиком и точностью извлечения title / price / currency.
+
+Запуск из корня проекта:
+    python benchmarks/parser_bench.py --runs 5 --out bench.json
+    python benchmarks/parser_bench.py --runs 5 --compare bench.json   # сравнить с прошлым прогоном
+    python benchmarks/parser_bench.py --runs 5 --mode http              # только один путь парсинга
+
+Каждая страница живёт на своём loopback-адресе (127.0.0.2, 127.0.0.3, ...), поэтому для парсера
+это отдельный «домен» со своими селекторами (Linux: весь 127.0.0.0/8 смотрит на lo).
+База и cookies браузера (PARSER_STATE_DIR) — временные, в отдельной папке: рабочие bot_database.db
+и browser_state не трогаются. Парсинг идёт прямо в процессе бенчмарка (воркеры parser/workers.py не запускаются).
+Стратегия (parser/strategy.py) по умолчанию как в боте (--mode auto): первый прогон домена — гонка,
+дальше — её победитель, поэтому прогоны неравноценны; какой путь выбран, видно в "modes" отчёта.
+--mode race / http / browser закрепляет один путь для всех прогонов.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIELDS = ("title", "price", "currency")
+MODES = ("auto", "race", "http", "browser")
+START_DIR = os.getcwd()  # относительные --out / --compare считаем от папки запуска
+
+
+def load_manifest(only=None) -> list:
+    with open(os.path.join(FIXTURES_DIR, "manifest.json"), encoding="utf-8") as f:
+        fixtures = json.load(f)
+    if only:
+        fixtures = [fx for fx in fixtures if fx["name"] in only]
+    for i, fx in enumerate(fixtures):
+        fx["host"] = f"127.0.0.{i + 2}"
+    return fixtures
+
+
+async def start_server(fixtures):
+    """Один aiohttp-сервер, по адресу на каждую страницу."""
+    from aiohttp import web
+
+    pages = {}
+    for fx in fixtures:
+        with open(os.path.join(FIXTURES_DIR, fx["file"]), encoding="utf-8") as f:
+            pages[fx["host"]] = f.read()
+
+    async def handle(request):
+        host = request.transport.get_extra_info("sockname")[0]
+        if host not in pages:
+            return web.Response(status=404)
+        return web.Response(text=pages[host], content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    port = None
+    for fx in fixtures:
+        site = web.TCPSite(runner, fx["host"], port or 0)
+        await site.start()
+        port = port or runner.addresses[0][1]
+        fx["url"] = f"http://{fx['host']}:{port}/product/{fx['name']}"
+    return runner
+
+
+async def prepare_db(fixtures):
+    """Временная база: селекторы магазинов как из админки, кеш выключен (cache_ttl_default = 0)."""
+    from database.db_setup import init_db, async_session
+    from database.models import SiteSetting, GlobalSetting
+    from parser.extractors import BUILTIN_RULES
+
+    await init_db()
+    async with async_session() as session:
+        session.add(GlobalSetting(key="cache_ttl_default", value=0))
+        for fx in fixtures:
+            rule = BUILTIN_RULES.get(fx.get("rules_from"), {})
+            session.add(SiteSetting(
+                name=fx["name"], domain=fx["host"], url=f"http://{fx['host']}/",
+                name_selector="\n".join(rule.get("name", [])) or None,
+                price_selector="\n".join(rule.get("price", [])) or None,
+                image_selector="\n".join(rule.get("image", [])) or None,
+            ))
+        await session.commit()
+
+
+def check(result: dict, expected: dict) -> dict:
+    """Совпадение каждого поля с ожидаемым (цена сравнивается как число)."""
+    ok = {}
+    for field in FIELDS:
+        got, want = result.get(field), expected.get(field)
+        if field == "price":
+            try:
+                ok[field] = abs(float(got) - float(want)) < 0.005
+            except (TypeError, ValueError):
+                ok[field] = False
+        else:
+            ok[field] = (got or "").strip() == want
+    return ok
+
+
+def summarize(samples: list) -> dict:
+    from parser import metrics
+
+    latencies = [s["latency_ms"] for s in samples]
+    summary = {
+        "runs": len(samples),
+        "errors": sum(1 for s in samples if s["error"]),
+        "p50_ms": round(metrics.percentile(latencies, 0.5), 1),
+        "p95_ms": round(metrics.percentile(latencies, 0.95), 1),
+        "round_trips_avg": round(sum(s["round_trips"] for s in samples) / max(1, len(samples)), 2),
+        "bytes_avg": round(sum(s["bytes"] for s in samples) / max(1, len(samples))),
+        "modes": {},
+        "strategies": {},
+        "accuracy": {},
+    }
+    for s in samples:
+        summary["modes"][s["mode"]] = summary["modes"].get(s["mode"], 0) + 1
+        summary["strategies"][s["strategy"]] = summary["strategies"].get(s["strategy"], 0) + 1
+    for field in FIELDS:
+        summary["accuracy"][field] = round(sum(1 for s in samples if s["ok"][field]) / max(1, len(samples)), 3)
+    return summary
+
+
+def pin_strategy(mode: str) -> dict:
+    """
+    Подменяет выбор стратегии: mode из MODES ("auto" — как в боте, остальные — всегда этот путь).
+    Возвращает словарь домен -> путь, выбранный для последнего запроса.
+    """
+    from parser.strategy import strategy_planner
+
+    choose = strategy_planner.choose
+    chosen = {}
+
+    async def pinned(domain):
+        chosen[domain] = await choose(domain) if mode == "auto" else mode
+        return chosen[domain]
+
+    strategy_planner.choose = pinned
+    return chosen
+
+
+async def run_bench(fixtures, runs: int, mode: str = "auto") -> dict:
+    from parser.engine import get_product_info
+    from parser.pool import browser_pool
+    from parser.static import close_http_session
+    from parser.utils import get_domain
+
+    chosen = pin_strategy(mode)
+    samples = {fx["name"]: [] for fx in fixtures}
+    try:
+        for _ in range(runs):
+            for fx in fixtures:
+                started = time.perf_counter()
+                try:
+                    result = await get_product_info(fx["url"], force_refresh=True)
+                except Exception as e:
+                    result = {"error": str(e)}
+                latency = (time.perf_counter() - started) * 1000
+                net = result.get("net") or {}
+                samples[fx["name"]].append({
+                    "latency_ms": latency,
+                    "mode": chosen.pop(get_domain(fx["url"]), "none"),
+                    "strategy": result.get("strategy") or "error",
+                    "round_trips": net.get("round_trips", 0),
+                    "bytes": net.get("transferred_bytes", 0),
+                    "error": result.get("error"),
+                    "ok": check(result, fx["expected"]),
+                    "got": {field: result.get(field) for field in FIELDS},
+                })
+    finally:
+        await browser_pool.stop()
+        await close_http_session()
+
+    report = {"fixtures": {}, "total": summarize([s for group in samples.values() for s in group])}
+    for name, group in samples.items():
+        report["fixtures"][name] = dict(summarize(group), last=group[-1]["got"], last_error=group[-1]["error"])
+    return report
+
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def print_comparison(old: dict, new: dict):
+    """Разница с прошлым прогоном по главным цифрам (в stderr, чтобы не мешать JSON в stdout)."""
+    keys = ("p50_ms", "p95_ms", "round_trips_avg", "bytes_avg")
+    for name in ["total"] + sorted(new["fixtures"]):
+        a = old["total"] if name == "total" else old.get("fixtures", {}).get(name)
+        b = new["total"] if name == "total" else new["fixtures"][name]
+        if not a:
+            print(f"{name}: нет в прошлом прогоне", file=sys.stderr)
+            continue
+        parts = [f"{k} {a.get(k)} -> {b.get(k)}" for k in keys]
+        parts += [f"acc.{f} {a['accuracy'].get(f)} -> {b['accuracy'].get(f)}" for f in FIELDS]
+        print(f"{name}: " + ", ".join(parts), file=sys.stderr)
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description="Офлайн-бенчмарк парсера товаров")
+    arg_parser.add_argument("--runs", type=int, default=3, help="сколько раз прогнать каждую страницу")
+    arg_parser.add_argument("--only", nargs="*", help="имена страниц из manifest.json")
+    arg_parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    arg_parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    arg_parser.add_argument("--mode", choices=MODES, default="auto",
+                            help="путь парсинга: auto — как в боте (гонка, потом победитель), иначе — только этот")
+    args = arg_parser.parse_args()
+
+    fixtures = load_manifest(args.only)
+    runner = await start_server(fixtures)
+    try:
+        await prepare_db(fixtures)
+        results = await run_bench(fixtures, args.runs, args.mode)
+    finally:
+        await runner.cleanup()
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "mode": args.mode,
+        **results,
+    }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(os.path.join(START_DIR, args.out), "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"📊 Результат записан в {args.out}", file=sys.stderr)
+    else:
+        sys.__stdout__.write(text + "\n")
+
+    if args.compare:
+        with open(os.path.join(START_DIR, args.compare), encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == "__main__":
+    # Проект — в sys.path, а рабочая папка — временная: там и создастся bot_database.db бенчмарка,
+    # и там же cookies браузера — до импорта парсера, который читает PARSER_STATE_DIR при загрузке
+    sys.path.insert(0, PROJECT_ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="parser_bench_"))
+    os.environ["PARSER_STATE_DIR"] = os.path.join(os.getcwd(), "browser_state")
+    # Логи парсера — в stderr, stdout остаётся для JSON
+    sys.stdout = sys.stderr
+    asyncio.run(main())
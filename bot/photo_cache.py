@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from database.db_setup import async_session
+from database.models import ImageAsset
+from parser.static import get_http_session
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Куда складываем скачанные картинки (файл = sha256 содержимого)
+IMAGE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(PROJECT_ROOT, "image_cache"))
+MAX_IMAGE_BYTES = 10 * 1024 * 1024   # больше Telegram всё равно не примет как фото
+EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+def _url_hash(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+class PhotoCache:
+    """
+    Фото товаров и акций: картинка магазина скачивается один раз (на диск, по хешу содержимого),
+    загружается в Telegram один раз, а дальше все отправки идут по сохранённому file_id.
+    Так Telegram не ходит в магазин на каждую отправку, а магазины, блокирующие его загрузчик,
+    всё равно показываются с фото.
+    """
+
+    def __init__(self, image_dir: str = IMAGE_DIR):
+        self.image_dir = image_dir
+        self._assets = {}   # url_hash -> {"file_path", "tg_file_id", "content_hash"}
+        self._locks = {}    # url_hash -> Lock: одна загрузка на картинку
+
+    async def _load(self, url: str):
+        key = _url_hash(url)
+        if key in self._assets:
+            return self._assets[key]
+        try:
+            async with async_session() as session:
+                res = await session.execute(select(ImageAsset).where(ImageAsset.url_hash == key))
+                row = res.scalar_one_or_none()
+        except Exception as e:
+            print(f"⚠️ [PHOTO] Ошибка чтения: {e}")
+            return None
+        if row:
+            self._assets[key] = {"file_path": row.file_path, "tg_file_id": row.tg_file_id,
+                                 "content_hash": row.content_hash}
+        return self._assets.get(key)
+
+    async def _save(self, url: str, **fields):
+        key = _url_hash(url)
+        self._assets.setdefault(key, {"file_path": None, "tg_file_id": None, "content_hash": None}).update(
+            {k: v for k, v in fields.items() if k in ("file_path", "tg_file_id", "content_hash")}
+        )
+        try:
+            async with async_session() as session:
+                stmt = insert(ImageAsset).values(url_hash=key, source_url=url, **fields)
+                stmt = stmt.on_conflict_do_update(index_elements=['url_hash'], set_=fields)
+                await session.execute(stmt)
+                await session.commit()
+        except Exception as e:
+            print(f"⚠️ [PHOTO] Ошибка записи: {e}")
+
+    async def _download(self, url: str):
+        """Скачивает картинку и кладёт на диск. Возвращает (sha256, путь, размер) или None."""
+        try:
+            async with get_http_session().get(url, allow_redirects=True) as resp:
+                content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                if resp.status != 200 or not content_type.startswith("image/"):
+                    return None
+                body = bytearray()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    body += chunk
+                    if len(body) > MAX_IMAGE_BYTES:
+                        return None
+        except Exception as e:
+            print(f"⚠️ [PHOTO] Не удалось скачать {url}: {e}")
+            return None
+
+        content_hash = hashlib.sha256(body).hexdigest()
+        path = os.path.join(self.image_dir, content_hash[:2], content_hash + EXTENSIONS.get(content_type, ".jpg"))
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+        return content_hash, path, len(body)
+
+    async def _file_id_by_content(self, content_hash: str):
+        """Та же картинка могла уже уйти в Telegram под другой ссылкой (разные размеры/CDN)."""
+        try:
+            async with async_session() as session:
+                res = await session.execute(
+                    select(ImageAsset.tg_file_id)
+                    .where(ImageAsset.content_hash == content_hash, ImageAsset.tg_file_id != None)
+                    .limit(1)
+                )
+                return res.scalar_one_or_none()
+        except Exception:
+            return None
+
+    async def resolve(self, url: str):
+        """Что передать в send_photo: ("file_id", id), ("upload", файл) или ("url", ссылка), если скачать не вышло."""
+        key = _url_hash(url)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            asset = await self._load(url)
+            if asset and asset["tg_file_id"]:
+                return "file_id", asset["tg_file_id"]
+            if asset and asset["file_path"] and os.path.exists(asset["file_path"]):
+                return "upload", FSInputFile(asset["file_path"])
+
+            downloaded = await self._download(url)
+            if not downloaded:
+                return "url", url
+            content_hash, path, size = downloaded
+            file_id = await self._file_id_by_content(content_hash)
+            await self._save(url, content_hash=content_hash, file_path=path, size_bytes=size, tg_file_id=file_id)
+            if file_id:
+                return "file_id", file_id
+            return "upload", FSInputFile(path)
+
+    async def send(self, send, url: str, **kwargs):
+        """
+        Отправка фото с кешем: `await photo_cache.send(message.answer_photo, url, caption=...)`.
+        send — любой метод aiogram, принимающий photo= (answer_photo, bot.send_photo с partial и т.п.).
+        """
+        kind, photo = await self.resolve(url)
+        try:
+            msg = await send(photo=photo, **kwargs)
+        except TelegramBadRequest:
+            if kind != "file_id":
+                raise
+            # Сохранённый file_id больше не действует (например, сменился токен бота) — загружаем заново
+            await self._save(url, tg_file_id=None)
+            kind, photo = await self.resolve(url)
+            msg = await send(photo=photo, **kwargs)
+
+        if kind != "file_id" and getattr(msg, "photo", None):
+            await self._save(url, tg_file_id=msg.photo[-1].file_id)
+        return msg
+
+
+photo_cache = PhotoCache()
@@ -20,6 +20,26 @@ async_session = sessionmaker(
 )
 
 
+# Колонки, добавленные в уже существующие таблицы: create_all их не добавляет
+NEW_COLUMNS = {
+    "promotions": {"site_id": "INTEGER", "discount": "VARCHAR", "entry_hash": "VARCHAR(40)"},
+}
+NEW_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_promotions_entry_hash ON promotions (entry_hash)",
+]
+
+
+def _add_missing_columns(conn):
+    for table, columns in NEW_COLUMNS.items():
+        existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+        for name, ddl in columns.items():
+            if existing and name not in existing:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+                print(f"✅ Колонка '{name}' добавлена в {table}.")
+    for ddl in NEW_INDEXES:
+        conn.exec_driver_sql(ddl)
+
+
 # 3. Функция инициализации базы
 async def init_db():
     try:
@@ -29,6 +49,8 @@ async def init_db():
 
             # Создаем все таблицы, описанные в models.py (включая Admin, User и т.д.)
             await conn.run_sync(Base.metadata.create_all)
+            # И новые колонки в старых таблицах (простая миграция, как в migrate_db.py)
+            await conn.run_sync(_add_missing_columns)
 
         print("✅ База данных успешно инициализирована и готова к работе.")
     except Exception as e:
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, BigInteger, Boolean, Text, func
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, BigInteger, Boolean, Text, func, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, relationship
 from datetime import datetime
 
@@ -73,6 +73,95 @@ class Promotion(Base):
     image_url = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=func.now())
+    # Для акций, найденных сканером по карточкам на странице (см. parser/promo_text.py)
+    site_id = Column(Integer, nullable=True)
+    discount = Column(String, nullable=True)
+    entry_hash = Column(String(40), unique=True, index=True, nullable=True) # sha1(сайт|ссылка|текст) — защита от дублей
+
+class Product(Base):
+    """Индекс уже разобранных товаров (ключ — хеш канонического URL); он же кеш парсера"""
+    __tablename__ = 'products'
+    id = Column(Integer, primary_key=True)
+    url_hash = Column(String(40), unique=True, index=True, nullable=False) # sha1 канонического URL
+    url = Column(String, nullable=False) # канонический URL
+    domain = Column(String, nullable=True, index=True)
+    title = Column(String, nullable=True)
+    image_url = Column(String, nullable=True)
+    price = Column(Float, nullable=True)
+    currency = Column(String, nullable=True)
+    payload = Column(Text, nullable=False) # JSON-результат get_product_info
+    expires_at = Column(DateTime, nullable=False) # до какого момента отвечаем из индекса без парсинга
+    first_seen_at = Column(DateTime, default=func.now())
+    last_parsed_at = Column(DateTime, default=func.now())
+
+    prices = relationship("PriceHistory", back_populates="product", cascade="all, delete-orphan")
+
+class PriceHistory(Base):
+    """История цен товара: строка на каждый удачный парсинг (только добавление)"""
+    __tablename__ = 'price_history'
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), index=True, nullable=False)
+    price = Column(Float, nullable=False)
+    currency = Column(String, nullable=True)
+    observed_at = Column(DateTime, default=func.now(), index=True)
+
+    product = relationship("Product", back_populates="prices")
+
+class ImageAsset(Base):
+    """Картинка товара/акции: скачана один раз (файл по хешу содержимого) и загружена в Telegram один раз"""
+    __tablename__ = 'image_assets'
+    id = Column(Integer, primary_key=True)
+    url_hash = Column(String(40), unique=True, index=True, nullable=False) # sha1 ссылки на картинку
+    source_url = Column(String, nullable=False)
+    content_hash = Column(String(64), index=True, nullable=True) # sha256 содержимого
+    file_path = Column(String, nullable=True)
+    tg_file_id = Column(String, nullable=True)
+    size_bytes = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+
+class PriceSourceStat(Base):
+    """Откуда парсер достал цену на домене (селектор / JSON-LD / og) — для порядка перебора"""
+    __tablename__ = 'price_source_stats'
+    __table_args__ = (UniqueConstraint('domain', 'source'),)
+    id = Column(Integer, primary_key=True)
+    domain = Column(String, nullable=False, index=True)
+    source = Column(String, nullable=False) # "css:<селектор>", "jsonld" или "og"
+    hits = Column(Integer, default=0)
+    last_hit_at = Column(DateTime, default=func.now())
+
+class PromoScanState(Base):
+    """Что сканер акций видел на сайте в прошлый раз: валидаторы для условного GET и хеш страницы"""
+    __tablename__ = 'promo_scan_states'
+    id = Column(Integer, primary_key=True)
+    site_id = Column(Integer, ForeignKey("site_settings.id", ondelete="CASCADE"), unique=True, nullable=False)
+    url = Column(String, nullable=False) # для какого адреса сохранены валидаторы (адрес сайта могли поменять)
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    body_hash = Column(String(64), nullable=True) # sha256 тела страницы
+    has_promo = Column(Boolean, default=False) # результат последнего разбора
+    promo_text = Column(String, nullable=True) # фрагмент страницы вокруг найденной акции
+    entry_hashes = Column(Text, nullable=True) # JSON-список хешей карточек акций с прошлого разбора (снимок)
+    last_status = Column(Integer, nullable=True)
+    checked_at = Column(DateTime, default=func.now())
+    changed_at = Column(DateTime, nullable=True) # когда страница в последний раз реально изменилась
+    interval_sec = Column(Integer, nullable=True) # текущий период проверки (подстраивается под частоту изменений)
+    next_run_at = Column(DateTime, nullable=True, index=True) # когда планировщику проверить сайт снова
+
+class ProxyEndpoint(Base):
+    """Прокси из пула: оценки скорости и успешности, карантин для «выгоревших»"""
+    __tablename__ = 'proxy_endpoints'
+    id = Column(Integer, primary_key=True)
+    url = Column(String, unique=True, nullable=False) # http://user:password@ip:port
+    is_active = Column(Boolean, default=True)
+    latency_ms = Column(Float, nullable=True) # скользящее среднее времени ответа
+    success_rate = Column(Float, default=1.0) # скользящая доля успешных запросов
+    requests = Column(Integer, default=0)
+    failures = Column(Integer, default=0)
+    quarantines = Column(Integer, default=0) # сколько раз подряд уходил в карантин (растёт срок)
+    quarantined_until = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    last_used_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=func.now())
 
 # --- 4. ЗАКАЗЫ И КОРЗИНА ---
 
@@ -4,14 +4,13 @@ import logging
 import sys
 import re
 import os
+import html
 from datetime import datetime
 from urllib.parse import urlparse
 from os import getenv # Добавляем ЭТУ строку, чтобы getenv() работала напрямую
 import sqlalchemy
 from sqlalchemy import select, func, or_
 # === 2. СТОРОННИЕ БИБЛИОТЕКИ (BS4, HTTP, DOTENV) ===
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 
 # === 3. SQLALCHEMY (РАБОТА С БАЗОЙ) ===
@@ -20,6 +19,7 @@ from sqlalchemy import (
     String, DateTime, Boolean, Float, ForeignKey, BigInteger, Text
 )
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.sqlite import insert
 
 # === 4. AIOGRAM (ЛОГИКА БОТА) ===
 from aiogram import Bot, Dispatcher, types, F, BaseMiddleware
@@ -45,7 +45,19 @@ from database.models import (
     GlobalSetting, Promotion, StockItem, StockCategory,
     CartItem, SupportTicket, Site
 )
-from parser.engine import get_product_info
+from parser.engine import get_product_info, get_products_info
+from parser.workers import parser_workers, ParserQueueFull
+from parser.cache import product_cache
+from parser.blocking import block_profile
+from parser.breaker import domain_guard
+from parser import metrics as parser_metrics
+from parser.extractors import extractor_registry, split_selectors
+from parser.static import close_http_session
+from parser.promo_scanner import run_promo_scanner, close_scanner_session, last_scan_stats, save_promotions
+from parser.promo_scheduler import promo_scheduler
+from parser.proxies import proxy_pool
+from parser.urls import canonical_url
+from bot.photo_cache import photo_cache
 from bot.keyboards import (
     get_final_menu_v2, get_categories_kb, get_shops_grid_kb,
     get_shop_action_kb, get_admin_main_kb, get_admin_categories_kb,
@@ -105,6 +117,7 @@ class AdminSettings(StatesGroup):
     waiting_for_site_url_edit = State()
     waiting_for_site_name = State()
     waiting_for_admin_question = State()
+    waiting_for_site_selectors = State()  # Селекторы парсера (name/price/image)
 
 
 class MailingStates(StatesGroup):
@@ -799,32 +812,38 @@ async def get_promo_count(session) -> int:
 # Функция для вызова меню прокси (можно добавить кнопку в admin_panel)
 @dp.callback_query(F.data == "admin_proxy_menu")
 async def admin_proxy_menu(callback: CallbackQuery):
-    async with async_session() as session:
-        # Получаем статус и URL из базы
-        res_status = await session.execute(select(GlobalSetting).where(GlobalSetting.key == "proxy_enabled"))
-        status_setting = res_status.scalar_one_or_none()
-        is_on = status_setting.value == 1.0 if status_setting else False
-
-        res_url = await session.execute(select(GlobalSetting).where(GlobalSetting.key == "proxy_url"))
-        url_setting = res_url.scalar_one_or_none()
-        # Если прокси сохранен как строка в value, выводим его
-        current_proxy = url_setting.value if url_setting else "Не установлен"
+    # Пул прокси (parser/proxies.py): статус из GlobalSetting, список с оценками
+    rows = await proxy_pool.report()
+    is_on = proxy_pool.enabled
+
+    lines = []
+    for r in rows:
+        latency = f"{r['latency_ms']} мс" if r['latency_ms'] is not None else "—"
+        status = f"🚧 карантин {r['quarantined_min']} мин" if r['quarantined_min'] else "🟢"
+        lines.append(
+            f"{status} <code>{r['host']}</code> | {latency} | успех {r['success_rate']:.0%} | "
+            f"запросов {r['requests']}, сейчас {r['active']}"
+        )
 
     text = (
         f"🌐 <b>УПРАВЛЕНИЕ ПРОКСИ</b>\n"
         f"───────────────────\n"
         f"Текущий статус: {'✅ <b>ВКЛЮЧЕН</b>' if is_on else '❌ <b>ВЫКЛЮЧЕН</b>'}\n"
-        f"Адрес: <code>{current_proxy}</code>\n"
-        f"───────────────────\n"
-        f"<i>Без прокси такие сайты как Victoria's Secret выдают ошибку 403.</i>"
+        f"Прокси в пуле: <b>{len(rows)}</b>\n"
+        + ("\n".join(lines) + "\n" if lines else "")
+        + f"───────────────────\n"
+        f"<i>Запросы идут через лучший здоровый прокси; заблокированные уходят в карантин сами.\n"
+        f"Без прокси такие сайты как Victoria's Secret выдают ошибку 403.</i>"
     )
 
     builder = InlineKeyboardBuilder()
     builder.button(text="✅ Включить", callback_data="proxy_on")
     builder.button(text="❌ Выключить", callback_data="proxy_off")
-    builder.button(text="⌨️ Изменить адрес", callback_data="proxy_set_input")
+    builder.button(text="⌨️ Добавить прокси", callback_data="proxy_set_input")
+    for r in rows:
+        builder.button(text=f"🗑 {r['host']}", callback_data=f"proxy_del_{r['id']}")
     builder.button(text="🏠 В админку", callback_data="admin_panel")
-    builder.adjust(2, 1, 1)
+    builder.adjust(2, 1, *([1] * len(rows)), 1)
 
     await callback.message.edit_text(text, reply_markup=builder.as_markup(), parse_mode="HTML")
 
@@ -839,10 +858,19 @@ async def proxy_toggle(callback: CallbackQuery):
         await session.execute(stmt)
         await session.commit()
 
+    proxy_pool.reload()
     await callback.answer(f"Прокси {'включен' if new_val == 1.0 else 'выключен'}")
     await admin_proxy_menu(callback)
 
 
+# --- УДАЛЕНИЕ ПРОКСИ ИЗ ПУЛА ---
+@dp.callback_query(F.data.startswith("proxy_del_"))
+async def proxy_delete(callback: CallbackQuery):
+    await proxy_pool.remove(int(callback.data.split("_")[2]))
+    await callback.answer("Прокси удалён из пула")
+    await admin_proxy_menu(callback)
+
+
 # --- ЗАПРОС АДРЕСА ---
 @dp.callback_query(F.data == "proxy_set_input")
 async def proxy_input_start(callback: CallbackQuery, state: FSMContext):
@@ -850,7 +878,7 @@ async def proxy_input_start(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer(
         "⌨️ <b>Введите данные прокси в формате:</b>\n"
         "<code>http://user:password@ip:port</code>\n\n"
-        "<i>Или просто ip:port, если прокси без пароля.</i>",
+        "<i>Или просто ip:port, если прокси без пароля. Можно несколько — по одному в строке.</i>",
         parse_mode="HTML"
     )
     await callback.answer()
@@ -865,121 +893,25 @@ async def proxy_save(message: Message, state: FSMContext):
         return await message.answer("❌ Настройка прокси отменена.",
                                     reply_markup=get_admin_main_kb(0, 0))  # Укажите ваши счетчики
 
-    proxy_text = message.text.strip()
-
-    # Валидация: проверим, что это хотя бы похоже на адрес
-    if "." not in proxy_text:
-        return await message.answer("⚠️ Это не похоже на адрес. Введите в формате <code>ip:port</code>")
+    proxies = []
+    for proxy_text in message.text.split():
+        # Валидация: проверим, что это хотя бы похоже на адрес
+        if "." not in proxy_text:
+            return await message.answer(
+                f"⚠️ <code>{proxy_text}</code> не похоже на адрес. Введите в формате <code>ip:port</code>"
+            )
+        if "http" not in proxy_text:
+            proxy_text = f"http://{proxy_text}"
+        proxies.append(proxy_text)
 
-    if "http" not in proxy_text:
-        proxy_text = f"http://{proxy_text}"
-
-    async with async_session() as session:
-        # 2. ПРАВИЛЬНАЯ ЗАПИСЬ: пишем в value_str, а не в числовое value
-        stmt = insert(GlobalSetting).values(key="proxy_url", value_str=proxy_text)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=['key'],
-            set_=dict(value_str=proxy_text)
-        )
-        await session.execute(stmt)
-        await session.commit()
+    # 2. Добавляем в пул прокси (оценки и карантин — в parser/proxies.py)
+    added = await proxy_pool.add(proxies)
 
     await state.clear()
-    await message.answer(f"✅ Прокси успешно сохранен в текстовое поле базы.")
+    await message.answer(f"✅ Прокси добавлено в пул: {added}.")
     await admin_promo_hub(message, state)  # Возврат в хаб
 
 
-async def run_promo_scanner():
-    """
-    Сканер акций: проверяет активные сайты из таблицы SiteSetting.
-    Поддерживает опциональное использование прокси из настроек базы данных.
-    """
-    async with async_session() as session:
-        # 1. ПОЛУЧАЕМ НАСТРОЙКИ ПРОКСИ ИЗ БАЗЫ (GlobalSetting)
-        # Ищем статус (включен/выключен) - тут используем .value (число)
-        res_proxy_on = await session.execute(
-            select(GlobalSetting).where(GlobalSetting.key == "proxy_enabled")
-        )
-        proxy_setting = res_proxy_on.scalar_one_or_none()
-        is_proxy_active = proxy_setting.value == 1.0 if proxy_setting else False
-
-        # Ищем сам адрес прокси
-        res_proxy_url = await session.execute(
-            select(GlobalSetting).where(GlobalSetting.key == "proxy_url")
-        )
-        url_setting = res_proxy_url.scalar_one_or_none()
-
-        # ТЕХКОНТРОЛЬ: Берем адрес из value_str, чтобы не было ошибки конвертации в float
-        proxy_address = url_setting.value_str if url_setting else None
-
-        # Формируем объект прокси для requests
-        proxies = None
-        if is_proxy_active and proxy_address and "http" in str(proxy_address):
-            proxies = {
-                "http": proxy_address,
-                "https": proxy_address
-            }
-            print(f"🌐 [SCANNER] Прокси ВКЛЮЧЕН: {proxy_address}")
-        else:
-            print("⚠️ [SCANNER] Прокси ВЫКЛЮЧЕН или не задан. Работаю напрямую.")
-
-        # 2. ПОЛУЧАЕМ СПИСОК САЙТОВ ДЛЯ ПРОВЕРКИ
-        stmt = select(SiteSetting).where(
-            SiteSetting.is_active.in_([True, 1]),
-            SiteSetting.url != None,
-            SiteSetting.url != ""
-        )
-        result = await session.execute(stmt)
-        active_items = result.scalars().all()
-
-    if not active_items:
-        print("🔎 [SCANNER] Нет активных сайтов с URL для сканирования.")
-        return []
-
-    print(f"🚀 [SCANNER] Запуск проверки {len(active_items)} сайтов...")
-    found_promos = []
-
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Referer': 'https://www.google.com/'
-    }
-
-    # 3. ЦИКЛ ОБХОДА САЙТОВ
-    for item in active_items:
-        try:
-            response = requests.get(
-                item.url,
-                headers=headers,
-                proxies=proxies,
-                timeout=20,
-                verify=False
-            )
-
-            print(f"📡 Сайт: {item.name:15} | Статус: {response.status_code}")
-
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                page_content = soup.get_text().upper()
-                keywords = ["SALE", "OFF", "DISCOUNT", "CLEARANCE", "%", "АКЦИЯ", "СКИДКИ", "ПРОДАЖ"]
-
-                if any(word in page_content for word in keywords):
-                    found_promos.append({
-                        "site": item.name,
-                        "title": f"🔥 Найдена распродажа на {item.name}!",
-                        "url": item.url
-                    })
-                    print(f"✅ НАЙДЕНО: {item.name}")
-
-            elif response.status_code == 403:
-                print(f"🚫 {item.name}: Доступ заблокирован (нужен другой прокси).")
-
-        except Exception as e:
-            print(f"❌ Ошибка {item.name}: {str(e)[:50]}...")
-
-    return found_promos
-
-
 # --- ЗАПУСК СКАНЕРА ИЗ АДМИНКИ ---
 async def admin_promo_list(message: Message):
     async with async_session() as session:
@@ -1076,30 +1008,32 @@ async def admin_run_scanner_manual(callback: CallbackQuery, state: FSMContext):
 
     # 2. Сообщение о прогрессе
     status_msg = await callback.message.answer(
-        "⏳ <b>Начинаю сканирование 9 сайтов...</b>\n<i>Это может занять до 30-40 секунд.</i>",
+        "⏳ <b>Начинаю сканирование сайтов...</b>\n<i>Результат придёт сюда, бот пока доступен.</i>",
         parse_mode="HTML"
     )
 
-    # 3. Запуск парсера (ваша функция run_promo_scanner)
-    found_items = await run_promo_scanner()
-    new_added = 0
+    # 3. Скан идёт в фоне — хендлер не держит апдейт до конца проверки всех сайтов
+    task = asyncio.create_task(_manual_scan_job(callback.message, status_msg))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
-    # 4. Сохранение результатов
-    async with async_session() as session:
-        if found_items:
-            for item in found_items:
-                # Проверка по ссылке, чтобы не дублировать
-                exists = await session.execute(select(Promotion).where(Promotion.url == item['url']))
-                if not exists.scalar():
-                    session.add(Promotion(
-                        site_name=item['site'],
-                        title=item['title'],
-                        url=item['url'],
-                        is_active=True
-                    ))
-                    new_added += 1
-            await session.commit()
 
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_background_tasks = set()
+
+
+async def _manual_scan_job(message: Message, status_msg: Message):
+    try:
+        found_items = await run_promo_scanner()
+        scan_stats = dict(last_scan_stats)
+        # 4. Сохранение результатов
+        new_added = await save_promotions(found_items)
+    except Exception as e:
+        print(f"❌ [SCANNER] Ошибка ручного скана: {e}")
+        await status_msg.edit_text(f"❌ Ошибка сканирования: {str(e)[:100]}")
+        return
+
+    async with async_session() as session:
         # Получаем данные для обновления меню
         p_res = await session.execute(select(func.count(Promotion.id)).where(Promotion.is_active == True))
         p_total = p_res.scalar() or 0
@@ -1110,16 +1044,18 @@ async def admin_run_scanner_manual(callback: CallbackQuery, state: FSMContext):
     await status_msg.edit_text(
         f"✅ <b>Сканирование завершено!</b>\n"
         f"Добавлено новых: <b>{new_added}</b>\n"
+        f"Сайтов без изменений (не разбирались): <b>{scan_stats.get('skipped', 0)}</b>"
+        f" из {scan_stats.get('sites', 0)}\n"
         f"Всего актуальных в базе: <b>{p_total}</b>",
         parse_mode="HTML"
     )
 
     # 6. Обновляем главное меню админа
     new_kb = get_admin_main_kb(new_count=o_new, promo_count=p_total)
-    await callback.message.answer("Обновленное меню админ-панели:", reply_markup=new_kb)
+    await message.answer("Обновленное меню админ-панели:", reply_markup=new_kb)
 
     # 7. Выводим список карточек акций
-    await admin_show_all_promos(callback.message)
+    await admin_show_all_promos(message)
 
 
 # --- УДАЛЕНИЕ АКЦИИ ---
@@ -1273,7 +1209,7 @@ async def run_mass_broadcast(target_ids, promo, bot):
     for uid in target_ids:
         try:
             if promo.image_url:
-                await bot.send_photo(uid, promo.image_url, caption=promo_text, parse_mode="HTML")
+                await photo_cache.send(bot.send_photo, promo.image_url, chat_id=uid, caption=promo_text, parse_mode="HTML")
             else:
                 await bot.send_message(uid, promo_text, parse_mode="HTML")
             count += 1
@@ -1312,7 +1248,8 @@ async def process_direct_promo_send(callback: CallbackQuery, bot: Bot):
 
     try:
         if promo.image_url:
-            await bot.send_photo(target_tg_id, promo.image_url, caption=promo_text, parse_mode="HTML")
+            await photo_cache.send(bot.send_photo, promo.image_url, chat_id=target_tg_id, caption=promo_text,
+                                   parse_mode="HTML")
         else:
             await bot.send_message(target_tg_id, promo_text, parse_mode="HTML")
 
@@ -1353,7 +1290,7 @@ async def process_select_broadcast(message: Message, state: FSMContext, bot: Bot
     for uid in target_ids:
         try:
             if promo.image_url:
-                await bot.send_photo(uid, promo.image_url, caption=promo_text, parse_mode="HTML")
+                await photo_cache.send(bot.send_photo, promo.image_url, chat_id=uid, caption=promo_text, parse_mode="HTML")
             else:
                 await bot.send_message(uid, promo_text, parse_mode="HTML")
             success += 1
@@ -1375,7 +1312,7 @@ async def start_mass_send(callback, target_ids, promo, bot):
     for uid in target_ids:
         try:
             if promo.image_url:
-                await bot.send_photo(uid, promo.image_url, caption=promo_text, parse_mode="HTML")
+                await photo_cache.send(bot.send_photo, promo.image_url, chat_id=uid, caption=promo_text, parse_mode="HTML")
             else:
                 await bot.send_message(uid, promo_text, parse_mode="HTML")
             success += 1
@@ -1421,7 +1358,7 @@ async def handle_promo_broadcast(callback: CallbackQuery, bot: Bot):
     for uid in target_users:
         try:
             if promo.image_url:
-                await bot.send_photo(uid, promo.image_url, caption=promo_text, parse_mode="HTML")
+                await photo_cache.send(bot.send_photo, promo.image_url, chat_id=uid, caption=promo_text, parse_mode="HTML")
             else:
                 await bot.send_message(uid, promo_text, parse_mode="HTML")
             count += 1
@@ -1468,7 +1405,7 @@ async def handle_promo_broadcast(callback: CallbackQuery, bot: Bot):
     for uid in target_users:
         try:
             if promo.image_url:
-                await bot.send_photo(uid, promo.image_url, caption=promo_text, parse_mode="HTML")
+                await photo_cache.send(bot.send_photo, promo.image_url, chat_id=uid, caption=promo_text, parse_mode="HTML")
             else:
                 await bot.send_message(uid, promo_text, parse_mode="HTML")
             count += 1
@@ -1797,6 +1734,8 @@ async def finalize_site_addition(callback: CallbackQuery, state: FSMContext):
             # Получаем имя категории для сообщения
             cat_obj = await session.get(Category, cat_id)
 
+            # domain не пишем: он уникален, а у одного магазина может быть несколько сайтов
+            # (разные разделы/категории). Реестр парсера берёт домен из url (parser/extractors.py)
             new_site = SiteSetting(
                 name=site_name, url=url, logo_url=logo_url,
                 category_id=cat_id, is_active=True,
@@ -1804,6 +1743,7 @@ async def finalize_site_addition(callback: CallbackQuery, state: FSMContext):
             )
             session.add(new_site)
             await session.commit()
+        extractor_registry.invalidate()
 
         await callback.message.edit_text(
             f"✅ <b>Бренд добавлен!</b>\n🏷 <b>Название:</b> {site_name}\n📂 <b>Категория:</b> {cat_obj.name}",
@@ -1869,6 +1809,7 @@ async def admin_manage_single_site(callback: CallbackQuery):
     # Кнопки редактирования
     builder.button(text="✏️ Изменить название", callback_data=f"edit_name_{site.id}")
     builder.button(text="🔗 Изменить URL", callback_data=f"edit_url_{site.id}")  # ДОБАВИЛИ ЭТУ КНОПКУ
+    builder.button(text="🎯 Селекторы парсера", callback_data=f"edit_selectors_{site.id}")
 
     builder.button(text="🗑 УДАЛИТЬ САЙТ", callback_data=f"del_site_{site.id}")
     builder.button(text="⬅️ Назад к списку", callback_data=f"mod_cat_{site.category_id}")
@@ -1918,6 +1859,7 @@ async def edit_site_url_save(message: Message, state: FSMContext):
             update(SiteSetting).where(SiteSetting.id == site_id).values(url=new_url)
         )
         await session.commit()
+    extractor_registry.invalidate()
 
     await state.clear()
     await message.answer(f"✅ <b>Успешно!</b>\nURL изменен на: <code>{new_url}</code>", parse_mode="HTML")
@@ -1941,6 +1883,7 @@ async def delete_site_handler(callback: CallbackQuery):
             name = site.name
             await session.delete(site)
             await session.commit()
+            extractor_registry.invalidate()
             await callback.answer(f"✅ Сайт {name} удален", show_alert=True)
 
             # ВАЖНО: Вместо подмены callback.data, просто заново получаем список
@@ -1954,6 +1897,63 @@ async def delete_site_handler(callback: CallbackQuery):
             await callback.message.edit_text("🔧 <b>Настройка брендов</b>:", reply_markup=kb, parse_mode="HTML")
 
 
+# --- СЕЛЕКТОРЫ ПАРСЕРА ДЛЯ САЙТА ---
+@dp.callback_query(F.data.startswith("edit_selectors_"))
+async def edit_site_selectors_start(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    site_id = int(callback.data.split("_")[-1])
+
+    async with async_session() as session:
+        site = await session.get(SiteSetting, site_id)
+    if not site:
+        return await callback.message.answer("❌ Сайт не найден в базе.")
+
+    await state.update_data(edit_site_id=site_id)
+    await callback.message.answer(
+        f"🎯 <b>Селекторы парсера: {html.escape(site.name or '')}</b>\n"
+        f"───────────────────\n"
+        # В селекторах бывают «>», «<» и «&» (div > span) — без экранирования Telegram не примет HTML
+        f"name: <code>{html.escape(site.name_selector or '—')}</code>\n"
+        f"price: <code>{html.escape(site.price_selector or '—')}</code>\n"
+        f"image: <code>{html.escape(site.image_selector or '—')}</code>\n"
+        f"───────────────────\n"
+        f"Пришлите новые значения построчно, например:\n"
+        f"<code>price: .price-sales .value; .price-sales</code>\n"
+        f"<code>image: img.product-main</code>\n\n"
+        f"<i>Несколько селекторов — через «;». Чтобы очистить поле: <code>price: -</code></i>",
+        parse_mode="HTML"
+    )
+    await state.set_state(AdminSettings.waiting_for_site_selectors)
+
+
+@dp.message(AdminSettings.waiting_for_site_selectors)
+async def edit_site_selectors_save(message: Message, state: FSMContext):
+    fields = {"name": "name_selector", "price": "price_selector", "image": "image_selector"}
+    values = {}
+    for line in message.text.splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip().lower()
+        if key in fields:
+            value = value.strip()
+            values[fields[key]] = None if value in ("", "-") else "; ".join(split_selectors(value))
+
+    if not values:
+        return await message.answer("⚠️ Не нашёл строк вида <code>price: селектор</code>. Попробуйте ещё раз.",
+                                    parse_mode="HTML")
+
+    data = await state.get_data()
+    async with async_session() as session:
+        await session.execute(
+            update(SiteSetting).where(SiteSetting.id == data.get("edit_site_id")).values(**values)
+        )
+        await session.commit()
+
+    # Реестр экстракторов перестроится при следующем парсинге
+    extractor_registry.invalidate()
+    await state.clear()
+    await message.answer("✅ Селекторы сохранены. Парсер уже использует новые правила.")
+
+
 # 1. Начало редактирования
 @dp.callback_query(F.data.startswith("edit_name_"))
 async def edit_site_name_init(callback: CallbackQuery, state: FSMContext):
@@ -3684,25 +3684,202 @@ async def back_to_cats(callback: types.CallbackQuery):
     await callback.message.answer("📍 <b>Выберите категорию:</b>", reply_markup=kb, parse_mode="HTML")
 
 
-# --- ПАРСИНГ И РАСЧЕТ (ИСПРАВЛЕННЫЙ БЛОК) ---
-@dp.message(F.text.contains("http"), StateFilter("*"))
-async def process_link(message: Message, state: FSMContext):
-    await state.clear()
-    urls = re.findall(r'(https?://[^\s]+)', message.text)
-    if not urls: return
+# --- КЕШ ПАРСЕРА: ПРИНУДИТЕЛЬНОЕ ОБНОВЛЕНИЕ И TTL (АДМИН) ---
+# /refresh <ссылка> — распарсить товар заново, мимо кеша
+@dp.message(Command("refresh"), StateFilter("*"))
+async def admin_refresh_link(message: Message, state: FSMContext):
+    await process_link(message, state, force_refresh=await is_admin(message.from_user.id))
 
-    wait_msg = await message.answer("🛠 <b>Минутку...</b> Проверяю цену и наличие...", parse_mode="HTML")
 
-    product = await get_product_info(urls[0])
+# /cachettl <домен|default> <минуты> — сколько хранить результат парсинга (0 — не кешировать)
+@dp.message(Command("cachettl"))
+async def admin_set_cache_ttl(message: Message):
+    if not await is_admin(message.from_user.id):
+        return
+
+    args = message.text.split()[1:]
+    if len(args) != 2 or not args[1].replace('.', '', 1).isdigit():
+        return await message.answer(
+            "⌨️ Формат: <code>/cachettl columbia.com 30</code> или <code>/cachettl default 60</code>",
+            parse_mode="HTML"
+        )
+
+    key = f"cache_ttl_{args[0].lower().removeprefix('www.')}"
+    minutes = float(args[1])
+    async with async_session() as session:
+        stmt = insert(GlobalSetting).values(key=key, value=minutes)
+        stmt = stmt.on_conflict_do_update(index_elements=['key'], set_=dict(value=minutes))
+        await session.execute(stmt)
+        await session.commit()
+
+    product_cache.reload_ttl()
+    await message.answer(f"✅ TTL кеша для <b>{args[0]}</b>: {minutes:g} мин.", parse_mode="HTML")
+
+
+# /pricetrend <ссылка> — история цены товара из индекса, без повторного парсинга
+@dp.message(Command("pricetrend"))
+async def admin_price_trend(message: Message):
+    if not await is_admin(message.from_user.id):
+        return
+
+    urls = re.findall(r'(https?://[^\s]+)', message.text or "")
+    if not urls:
+        return await message.answer("⌨️ Формат: <code>/pricetrend https://shop.com/product/123</code>",
+                                    parse_mode="HTML")
+
+    trend = await product_cache.price_trend(canonical_url(urls[0]))
+    if not trend or not trend[1]:
+        return await message.answer("ℹ️ Этот товар ещё ни разу не разбирался парсером.")
+    product, history = trend
+
+    prices = [h.price for h in history]
+    lines = [
+        f"📈 <b>{html.escape(product.title or 'Без названия')}</b>",
+        f"🌐 {product.domain} · в индексе с {product.first_seen_at:%d.%m.%Y}",
+        f"💰 Сейчас: <b>{product.price:g} {product.currency or ''}</b> "
+        f"(мин. {min(prices):g}, макс. {max(prices):g} за {len(prices)} замер.)",
+        "",
+    ]
+    previous = None
+    for h in reversed(history):
+        arrow = "" if previous is None or h.price == previous else (" 🔺" if h.price > previous else " 🔻")
+        lines.append(f"<code>{h.observed_at:%d.%m %H:%M}</code> — {h.price:g} {h.currency or ''}{arrow}")
+        previous = h.price
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+# /blockallow <домен> <типы/хосты через запятую> — что парсеру НЕ блокировать на этом магазине ("-" — сброс)
+@dp.message(Command("blockallow"))
+async def admin_set_block_allow(message: Message):
+    if not await is_admin(message.from_user.id):
+        return
 
+    args = message.text.split(maxsplit=2)[1:]
+    if len(args) != 2:
+        return await message.answer(
+            "⌨️ Формат: <code>/blockallow shop.com stylesheet, cdn.shop-assets.com</code>\n"
+            "Сброс исключений: <code>/blockallow shop.com -</code>",
+            parse_mode="HTML"
+        )
+
+    domain = args[0].lower().removeprefix("www.")
+    value = None if args[1].strip() == "-" else args[1].strip()
+    async with async_session() as session:
+        stmt = insert(GlobalSetting).values(key=f"block_allow_{domain}", value_str=value)
+        stmt = stmt.on_conflict_do_update(index_elements=['key'], set_=dict(value_str=value))
+        await session.execute(stmt)
+        await session.commit()
+
+    block_profile.reload()
+    await message.answer(f"✅ Исключения блокировки для <b>{html.escape(domain)}</b>: "
+                         f"<code>{html.escape(value or '—')}</code>",
+                         parse_mode="HTML")
+
+
+@dp.message(Command("breakers"))
+async def admin_parser_breakers(message: Message):
+    """Состояние предохранителей парсера по магазинам; /breakers reset shop.com — закрыть вручную."""
+    if not await is_admin(message.from_user.id):
+        return
+
+    args = message.text.split()[1:]
+    if len(args) == 2 and args[0] == "reset":
+        domain = args[1].lower().removeprefix("www.")
+        if domain_guard.reset(domain):
+            return await message.answer(f"🟢 Предохранитель для <b>{html.escape(domain)}</b> закрыт.",
+                                        parse_mode="HTML")
+        return await message.answer(f"ℹ️ По <b>{html.escape(domain)}</b> ещё не было запросов.", parse_mode="HTML")
+
+    rows = domain_guard.report()
+    if not rows:
+        return await message.answer("ℹ️ Парсер ещё не обращался ни к одному магазину.")
+
+    icons = {"closed": "🟢", "half-open": "🟡", "open": "🔴"}
+    lines = ["🛡 <b>Предохранители парсера</b>\n"]
+    for row in rows[:40]:
+        line = (f"{icons.get(row['state'], '⚪️')} <b>{html.escape(row['domain'])}</b> — ошибок {round(row['error_rate'] * 100)}% "
+                f"из {row['requests']}, сейчас парсится: {row['active']}")
+        if row['state'] == "open":
+            line += f", повтор через {row['retry_in']} c"
+        elif row['failures']:
+            line += f", неудач подряд: {row['failures']}"
+        lines.append(line)
+    lines.append("\nСброс: <code>/breakers reset shop.com</code>")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+@dp.message(Command("metrics"))
+async def admin_parser_metrics(message: Message):
+    """Метрики парсера с запуска бота: попадания в кеш и сэкономленный трафик по магазинам; /metrics shop.com — всё по домену."""
+    if not await is_admin(message.from_user.id):
+        return
+
+    report = parser_metrics.report()
+    if not report:
+        return await message.answer("ℹ️ Парсер ещё не обращался ни к одному магазину.")
+
+    args = message.text.split()[1:]
+    if args:
+        domain = args[0].lower().removeprefix("www.")
+        if domain not in report:
+            return await message.answer(f"ℹ️ По <b>{html.escape(domain)}</b> метрик пока нет.", parse_mode="HTML")
+        lines = [f"📊 <b>Метрики парсера: {html.escape(domain)}</b>\n"]
+        for name, value in sorted(report[domain].items()):
+            if isinstance(value, dict):
+                value = f"p50 {value['p50']} c, p90 {value['p90']} c (n={value['n']})"
+            lines.append(f"• {name}: {value}")
+        return await message.answer("\n".join(lines), parse_mode="HTML")
+
+    def mb(value):
+        return f"{value / 1024 / 1024:.1f} МБ"
+
+    rows = []
+    for domain, m in report.items():
+        requests = m.get("cache_hit", 0) + m.get("cache_miss", 0)
+        if domain == "*" or not requests:
+            continue
+        rows.append((requests, domain, m))
+    rows.sort(reverse=True)
+
+    total = {key: sum(m.get(key, 0) for _, _, m in rows)
+             for key in ("cache_hit", "cache_miss", "blocked_bytes_est", "transferred_bytes", "singleflight_saved")}
+    requests = total["cache_hit"] + total["cache_miss"]
+    downloaded = total["blocked_bytes_est"] + total["transferred_bytes"]
+    lines = [
+        "📊 <b>Метрики парсера</b> (с запуска бота)\n",
+        f"🔗 Запросов: {requests}, из кеша: {round(total['cache_hit'] / requests * 100) if requests else 0}%, "
+        f"склеено одинаковых: {total['singleflight_saved']}",
+        f"📉 Трафик браузера: скачано {mb(total['transferred_bytes'])}, "
+        f"сэкономлено блокировкой ~{mb(total['blocked_bytes_est'])}"
+        + (f" ({round(total['blocked_bytes_est'] / downloaded * 100)}%)" if downloaded else ""),
+        "",
+    ]
+    for requests, domain, m in rows[:30]:
+        line = (f"<b>{html.escape(domain)}</b> — {requests} запр., кеш {round(m.get('cache_hit', 0) / requests * 100)}%, "
+                f"сэкономлено ~{mb(m.get('blocked_bytes_est', 0))}")
+        if isinstance(m.get("time_to_price"), dict):
+            line += f", цена за p50 {m['time_to_price']['p50']} c"
+        lines.append(line)
+    lines.append("\nПодробно по магазину: <code>/metrics shop.com</code>")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+# Сколько ссылок из одного сообщения разбираем за раз
+MAX_LINKS_PER_MESSAGE = 10
+
+
+async def quote_product(product: dict):
+    """
+    Финансовый расчет по результату парсера: (цена на сайте, валюта, курс, итого грн, комиссия грн).
+    None — если цену распознать не удалось.
+    """
     try:
         clean_price = float(product.get('price', 0))
     except:
         clean_price = 0
 
     if "error" in product or clean_price == 0:
-        await wait_msg.edit_text("⚠️ Не удалось распознать цену автоматически.\nМенеджер проверит ссылку вручную.")
-        return
+        return None
 
     # --- ФИНАНСОВАЯ КОРРЕКТИРОВКА (ТЕХКОНТРОЛЬ) ---
     currency = product.get('currency', 'USD')
@@ -3718,7 +3895,70 @@ async def process_link(message: Message, state: FSMContext):
     # Расчет: Цена * 1.20 (комиссия) * Курс (1.0 для гривны)
     total_uah = round((clean_price * 1.20) * rate, 2)
     fee_uah = round((clean_price * 0.20) * rate, 2)
+    return clean_price, currency, rate, total_uah, fee_uah
+
+
+# --- ПАРСИНГ И РАСЧЕТ (ИСПРАВЛЕННЫЙ БЛОК) ---
+@dp.message(F.text.contains("http"), StateFilter("*"))
+async def process_link(message: Message, state: FSMContext, force_refresh: bool = False):
+    await state.clear()
+    urls = re.findall(r'(https?://[^\s]+)', message.text)
+    if not urls: return
+
+    # Несколько ссылок (вишлист) — один общий расчет
+    if len(urls) > 1:
+        return await process_links_batch(message, state, urls[:MAX_LINKS_PER_MESSAGE], force_refresh)
+
+    wait_msg = await message.answer("🛠 <b>Минутку...</b> Проверяю цену и наличие...", parse_mode="HTML")
+
+    # Если парсер занят — показываем место в очереди и примерное ожидание
+    async def show_queue_position(position, eta):
+        await wait_msg.edit_text(
+            f"⏳ <b>Вы в очереди: {position}-й</b>\nПримерное ожидание: ~{max(1, round(eta))} сек. Проверяю цену и наличие...",
+            parse_mode="HTML"
+        )
 
+    # Название и фото приходят раньше цены — сразу показываем карточку, цену допишем следом
+    card = {"msg": wait_msg, "photo": False, "done": False}
+    card_lock = asyncio.Lock()
+
+    async def show_partial(partial):
+        async with card_lock:
+            if card["done"]:
+                return
+            text = f"📦 <b>{html.escape(partial['title'])}</b>\n\n⏳ Уточняю цену и наличие..."
+            if partial.get('image'):
+                try:
+                    card["msg"] = await photo_cache.send(message.answer_photo, partial['image'], caption=text,
+                                                         parse_mode="HTML")
+                    card["photo"] = True
+                    await wait_msg.delete()
+                    return
+                except Exception:
+                    pass  # Telegram не смог скачать фото — покажем хотя бы название
+            await wait_msg.edit_text(text, parse_mode="HTML")
+
+    try:
+        product = await get_product_info(urls[0], force_refresh=force_refresh,
+                                         on_queued=show_queue_position, on_partial=show_partial)
+    except ParserQueueFull:
+        await wait_msg.edit_text("🙏 Сейчас очень много запросов.\nПожалуйста, пришлите ссылку ещё раз через минуту.")
+        return
+
+    async with card_lock:
+        card["done"] = True
+
+    quote = await quote_product(product)
+    if quote is None:
+        fail_text = "⚠️ Не удалось распознать цену автоматически.\nМенеджер проверит ссылку вручную."
+        if card["photo"]:
+            await card["msg"].edit_caption(caption=fail_text)
+        else:
+            await wait_msg.edit_text(fail_text)
+        return
+    clean_price, currency, rate, total_uah, fee_uah = quote
+
+    # В корзину и заказ идёт ссылка, которую прислал клиент (каноническая — только ключ кеша)
     await state.update_data(p_title=product['title'], p_price=total_uah, p_url=urls[0], p_currency=currency)
 
     # Формируем текст (Курс показываем только если он не равен 1.0)
@@ -3740,14 +3980,97 @@ async def process_link(message: Message, state: FSMContext):
     builder.button(text="🔎 Новый поиск", callback_data="back_to_cats")
     builder.adjust(1)
 
+    # Карточка с фото уже на экране — дописываем в неё цену и кнопки
+    if card["photo"]:
+        await card["msg"].edit_caption(caption=caption, reply_markup=builder.as_markup(), parse_mode="HTML")
+        return
+
     await wait_msg.delete()
     if product.get('image'):
-        await message.answer_photo(photo=product['image'], caption=caption, reply_markup=builder.as_markup(),
-                                   parse_mode="HTML")
+        await photo_cache.send(message.answer_photo, product['image'], caption=caption,
+                               reply_markup=builder.as_markup(), parse_mode="HTML")
     else:
         await message.answer(caption, reply_markup=builder.as_markup(), parse_mode="HTML")
 
 
+# --- НЕСКОЛЬКО ССЫЛОК В ОДНОМ СООБЩЕНИИ (ВИШЛИСТ) ---
+async def process_links_batch(message: Message, state: FSMContext, urls: list, force_refresh: bool = False):
+    wait_msg = await message.answer(
+        f"🛠 <b>Минутку...</b> Проверяю цены по {len(urls)} ссылкам...", parse_mode="HTML"
+    )
+
+    products = await get_products_info(urls, force_refresh=force_refresh)
+
+    lines, batch_items, failed = [], [], 0
+    total_sum = fee_sum = 0
+    for i, product in enumerate(products, 1):
+        quote = await quote_product(product)
+        if quote is None:
+            failed += 1
+            note = "парсер перегружен, пришлите позже" if product.get('busy') else "цену проверит менеджер"
+            lines.append(f"{i}. ⚠️ <a href='{html.escape(product.get('url', ''))}'>Ссылка</a> — {note}")
+            continue
+
+        clean_price, currency, rate, total_uah, fee_uah = quote
+        title = product['title']
+        lines.append(f"{i}. <b>{html.escape(title)}</b>\n    💰 {clean_price} {currency} → {total_uah} грн")
+        batch_items.append({"title": title, "price_uah": total_uah, "url": product['url']})
+        total_sum += total_uah
+        fee_sum += fee_uah
+
+    if not batch_items:
+        await wait_msg.edit_text("⚠️ Не удалось распознать цены автоматически.\nМенеджер проверит ссылки вручную.")
+        return
+
+    await state.update_data(batch_items=batch_items)
+
+    text = (
+        f"✅ <b>Найдено товаров: {len(batch_items)} из {len(products)}</b>\n\n"
+        + "\n".join(lines) +
+        f"\n───────────────────\n"
+        f"💵 <b>Итого к оплате: {round(total_sum, 2)} грн</b>\n"
+        f"<i>(Включая комиссию 20%: {round(fee_sum, 2)} грн)</i>"
+    )
+    if failed:
+        text += "\n\n<i>Товары без цены не входят в сумму — менеджер уточнит их вручную.</i>"
+
+    builder = InlineKeyboardBuilder()
+    builder.button(text=f"🛒 Добавить все в корзину ({len(batch_items)})", callback_data="confirm_add_all")
+    builder.button(text="🔎 Новый поиск", callback_data="back_to_cats")
+    builder.adjust(1)
+
+    await wait_msg.edit_text(text, reply_markup=builder.as_markup(), parse_mode="HTML",
+                             disable_web_page_preview=True)
+
+
+@dp.callback_query(F.data == "confirm_add_all")
+async def add_all_to_cart(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    batch_items = data.get("batch_items")
+    if not batch_items:
+        return await callback.answer("⚠️ Список устарел. Пришлите ссылки еще раз.", show_alert=True)
+
+    async with async_session() as session:
+        for item in batch_items:
+            session.add(CartItem(
+                user_id=callback.from_user.id,
+                title=item['title'],
+                price_uah=item['price_uah'],
+                size_details="Параметры уточнит менеджер",
+                url=item['url']
+            ))
+        await session.commit()
+
+    await state.clear()
+    await callback.answer("✅ Добавлено!")
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.message.answer(
+        f"✅ <b>В корзину добавлено товаров: {len(batch_items)}</b>\n\n"
+        "Размеры и цвета можно указать менеджеру при оформлении. Откройте 🛒 <b>Корзину</b>, чтобы оформить заказ.",
+        parse_mode="HTML"
+    )
+
+
 # --- ДОБАВЛЕНИЕ В КОРЗИНУ И ПАРАМЕТРЫ ---
 
 
@@ -4909,9 +5232,21 @@ async def main():
     # и не начнет спамить ответами при включении
     await bot.delete_webhook(drop_pending_updates=True)
 
-    # 6. Запуск опроса серверов
+    # 6. Запускаем процессы-парсеры с прогретыми браузерами (чтобы первая ссылка не ждала запуск Chromium)
+    await parser_workers.start()
+
+    # 7. Фоновый сканер акций: каждый сайт по своему расписанию
+    promo_scheduler.start()
+
+    # 8. Запуск опроса серверов
     print("🚀 Бот успешно запущен и готов к работе!")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await promo_scheduler.stop()
+        await parser_workers.stop()
+        await close_http_session()
+        await close_scanner_session()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,136 @@
+import os
+import time
+from urllib.parse import urlsplit
+
+from sqlalchemy import select
+
+from database.db_setup import async_session
+from database.models import GlobalSetting
+from parser import metrics
+
+# Типы ресурсов, которые парсеру цены не нужны
+DEFAULT_BLOCKED_TYPES = {"image", "media", "font", "stylesheet", "texttrack", "manifest", "eventsource"}
+
+# Аналитика, тег-менеджеры, чаты и реклама (совпадение по домену и всем поддоменам)
+DEFAULT_BLOCKED_HOSTS = {
+    # аналитика и тег-менеджеры
+    "google-analytics.com", "googletagmanager.com", "analytics.google.com", "clarity.ms",
+    "hotjar.com", "segment.com", "segment.io", "mixpanel.com", "amplitude.com", "heap.io",
+    "fullstory.com", "quantummetric.com", "nr-data.net", "newrelic.com", "optimizely.com",
+    "tealiumiq.com", "ensighten.com", "bat.bing.com", "scorecardresearch.com", "quantserve.com",
+    "dynatrace.com", "go-mpulse.net", "demdex.net", "omtrdc.net", "adobedtm.com",
+    # реклама и ретаргетинг
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "adservice.google.com",
+    "facebook.net", "facebook.com", "connect.facebook.net", "amazon-adsystem.com", "criteo.com",
+    "criteo.net", "taboola.com", "outbrain.com", "adnxs.com", "rubiconproject.com", "pubmatic.com",
+    "tiktok.com", "analytics.tiktok.com", "snapchat.com", "pinterest.com", "pinimg.com",
+    "rlcdn.com", "bluekai.com", "adsrvr.org", "mc.yandex.ru",
+    # чаты, виджеты, отзывы, email-маркетинг
+    "intercom.io", "intercomcdn.com", "zopim.com", "zendesk.com", "livechatinc.com", "drift.com",
+    "tawk.to", "gorgias.chat", "klaviyo.com", "attentivemobile.com", "onetrust.com",
+    "cookielaw.org", "trustpilot.com", "yotpo.com", "bazaarvoice.com", "powerreviews.com",
+}
+
+# Пользовательские добавки к deny-листу через .env (через запятую)
+DEFAULT_BLOCKED_HOSTS |= {h.strip() for h in os.getenv("PARSER_BLOCK_HOSTS", "").split(",") if h.strip()}
+
+# Типичный размер заблокированного ресурса (КБ) — для оценки сэкономленного трафика
+TYPICAL_SIZE_KB = {"image": 40, "media": 400, "font": 30, "stylesheet": 25, "script": 60}
+
+ALLOW_SETTINGS_REFRESH = 300  # как часто перечитывать исключения из базы (сек)
+
+
+def _host_matches(host: str, hosts) -> bool:
+    """host совпадает с доменом из списка или является его поддоменом."""
+    while host:
+        if host in hosts:
+            return True
+        if "." not in host:
+            return False
+        host = host.split(".", 1)[1]
+    return False
+
+
+class BlockProfile:
+    """
+    Профиль блокировки запросов для парсера: deny-лист типов ресурсов и трекеров
+    плюс исключения для отдельных магазинов, которым для цены нужен какой-то скрипт/стиль.
+    Исключения задаются в GlobalSetting: block_allow_<домен> = "stylesheet, cdn.shop-assets.com".
+    """
+
+    def __init__(self, blocked_types=None, blocked_hosts=None):
+        self.blocked_types = set(blocked_types or DEFAULT_BLOCKED_TYPES)
+        self.blocked_hosts = set(blocked_hosts or DEFAULT_BLOCKED_HOSTS)
+        self._allow = {}
+        self._allow_loaded_at = 0.0
+
+    async def allow_for(self, domain: str) -> set:
+        if time.monotonic() - self._allow_loaded_at > ALLOW_SETTINGS_REFRESH:
+            try:
+                async with async_session() as session:
+                    res = await session.execute(
+                        select(GlobalSetting).where(GlobalSetting.key.startswith("block_allow_"))
+                    )
+                    self._allow = {
+                        s.key.removeprefix("block_allow_"): {x.strip().lower() for x in s.value_str.split(",") if x.strip()}
+                        for s in res.scalars().all() if s.value_str
+                    }
+            except Exception as e:
+                print(f"⚠️ [PARSER] Не удалось прочитать исключения блокировки: {e}")
+            self._allow_loaded_at = time.monotonic()
+        return self._allow.get(domain, set())
+
+    def reload(self):
+        self._allow_loaded_at = 0.0
+
+    def block_reason(self, resource_type: str, host: str, domain: str, allow: set):
+        """Почему запрос надо заблокировать ('type' / 'host') или None, если пропускаем."""
+        if resource_type == "document":
+            return None
+        if resource_type in self.blocked_types and resource_type not in allow:
+            return "type"
+        # Хосты самого магазина по deny-листу не режем
+        if _host_matches(host, self.blocked_hosts) and not _host_matches(host, allow | {domain}):
+            return "host"
+        return None
+
+
+block_profile = BlockProfile()
+
+
+async def apply_block_profile(page, domain: str, allow: set) -> dict:
+    """
+    Вешает на страницу фильтр запросов и учёт трафика (allow — исключения домена из block_profile.allow_for).
+    Возвращает словарь статистики, который заполняется по ходу загрузки страницы.
+    """
+    stats = {"blocked_requests": 0, "blocked_bytes_est": 0, "transferred_bytes": 0}
+
+    async def handle_route(route):
+        request = route.request
+        host = (urlsplit(request.url).hostname or "").lower()
+        try:
+            if block_profile.block_reason(request.resource_type, host, domain, allow):
+                stats["blocked_requests"] += 1
+                stats["blocked_bytes_est"] += TYPICAL_SIZE_KB.get(request.resource_type, 10) * 1024
+                await route.abort()
+            else:
+                await route.continue_()
+        except Exception:
+            # Страница уже закрыта — запрос никому не нужен
+            pass
+
+    def on_response(response):
+        # Размер берём из заголовка — без лишнего запроса к браузеру
+        try:
+            stats["transferred_bytes"] += int(response.headers.get("content-length", 0))
+        except ValueError:
+            pass
+
+    await page.route("**/*", handle_route)
+    page.on("response", on_response)
+    return stats
+
+
+def record_block_stats(domain: str, stats: dict):
+    for name, value in stats.items():
+        metrics.incr(name, domain, value)
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from parser import metrics
+from parser.normalize import is_usable_price
+from parser.proxies import is_proxy_failure
+
+# --- НАСТРОЙКИ (можно переопределить через .env) ---
+BREAKER_FAILURES = int(os.getenv("PARSER_BREAKER_FAILURES", 5))      # неудач подряд, чтобы «выбить пробки»
+BREAKER_COOLDOWN = int(os.getenv("PARSER_BREAKER_COOLDOWN", 120))    # сек до пробного запроса
+BREAKER_MAX_COOLDOWN = 1800                                           # потолок при повторных провалах
+DOMAIN_MAX_PAGES = int(os.getenv("PARSER_DOMAIN_MAX_PAGES", 2))      # одновременных парсингов на домен
+OUTCOME_WINDOW = 50                                                   # по скольким последним запросам считаем % ошибок
+# Ответы магазина, которые считаются отказом: «доступ запрещён» и «слишком много запросов»
+BREAKER_STATUSES = {403, 429}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+def is_site_failure(result: dict) -> bool:
+    """
+    Магазин не ответил или отказал нам (сеть, таймаут, 403/429) — только это считает предохранитель.
+    Наши собственные таймауты и сбои (флаг "internal", см. parser/workers.py) — не вина магазина.
+    """
+    if result.get("internal") or ("error" not in result and is_usable_price(result.get("price"))):
+        return False
+    return is_proxy_failure(result.get("error")) or result.get("http_status") in BREAKER_STATUSES
+
+
+class _DomainState:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        self.trial_running = False
+        self.outcomes = deque(maxlen=OUTCOME_WINDOW)
+        self.sem = asyncio.Semaphore(DOMAIN_MAX_PAGES)
+        self.active = 0
+
+    @property
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+
+class DomainGuard:
+    """
+    Защита пула браузеров от «больных» магазинов:
+    - предохранитель: после BREAKER_FAILURES неудач подряд домен не парсится BREAKER_COOLDOWN сек
+      (сразу ответ «менеджер проверит вручную»), затем один пробный запрос решает, закрыть его или нет;
+    - не больше DOMAIN_MAX_PAGES одновременных парсингов одного домена.
+    Неудача — только то, что говорит о магазине: ошибка сети, таймаут, ответ 403/429
+    (см. is_site_failure). «Страница открылась, но цену не нашли» — забота селекторов, а не повод отключать домен.
+    """
+
+    def __init__(self):
+        self._domains = {}
+
+    def _get(self, domain: str) -> _DomainState:
+        if domain not in self._domains:
+            self._domains[domain] = _DomainState()
+        return self._domains[domain]
+
+    def allow(self, domain: str) -> bool:
+        """Можно ли сейчас парсить домен. В полуоткрытом состоянии пропускает один пробный запрос."""
+        st = self._get(domain)
+        if st.state == CLOSED:
+            return True
+        if st.state == OPEN and time.monotonic() - st.opened_at >= st.cooldown:
+            st.state = HALF_OPEN
+        if st.state == HALF_OPEN and not st.trial_running:
+            st.trial_running = True
+            return True
+        metrics.incr("breaker_rejected", domain)
+        return False
+
+    def record(self, domain: str, ok: bool):
+        st = self._get(domain)
+        st.outcomes.append(ok)
+        was_trial, st.trial_running = st.trial_running, False
+
+        if ok:
+            if st.state != CLOSED:
+                print(f"🟢 [PARSER] {domain}: предохранитель закрыт, магазин снова отвечает")
+            st.state, st.failures, st.cooldown = CLOSED, 0, BREAKER_COOLDOWN
+            return
+
+        st.failures += 1
+        if was_trial:
+            # Пробный запрос провалился — ждём дольше
+            st.cooldown = min(BREAKER_MAX_COOLDOWN, st.cooldown * 2)
+        if st.state != OPEN and (was_trial or st.failures >= BREAKER_FAILURES):
+            st.state, st.opened_at = OPEN, time.monotonic()
+            metrics.incr("breaker_opened", domain)
+            print(f"🔴 [PARSER] {domain}: предохранитель открыт на {st.cooldown} c после {st.failures} неудач подряд")
+
+    def forget_trial(self, domain: str):
+        """Запрос не дошёл до магазина (например, очередь переполнена) — пробный слот освобождаем без оценки."""
+        self._get(domain).trial_running = False
+
+    def reset(self, domain: str) -> bool:
+        if domain not in self._domains:
+            return False
+        st = self._domains[domain]
+        st.state, st.failures, st.cooldown, st.trial_running = CLOSED, 0, BREAKER_COOLDOWN, False
+        return True
+
+    @asynccontextmanager
+    async def slot(self, domain: str):
+        """Ограничение одновременных парсингов одного домена (парсинг в цикле бота, без воркеров)."""
+        st = self._get(domain)
+        async with st.sem:
+            st.active += 1
+            try:
+                yield
+            finally:
+                st.active -= 1
+
+    def try_take(self, domain: str) -> bool:
+        """
+        Слот домена без ожидания — для очереди воркеров (parser/workers.py): задача занятого домена
+        остаётся в очереди (и считается в её лимите), а не висит отдельно от неё.
+        """
+        st = self._get(domain)
+        if st.active >= DOMAIN_MAX_PAGES:
+            return False
+        st.active += 1
+        return True
+
+    def give_back(self, domain: str):
+        st = self._get(domain)
+        st.active = max(0, st.active - 1)
+
+    def report(self) -> list:
+        """Состояние доменов для админки: сначала проблемные."""
+        now = time.monotonic()
+        rows = []
+        for domain, st in self._domains.items():
+            retry_in = max(0, round(st.cooldown - (now - st.opened_at))) if st.state == OPEN else 0
+            rows.append({
+                "domain": domain,
+                "state": st.state,
+                "failures": st.failures,
+                "error_rate": round(st.error_rate, 2),
+                "requests": len(st.outcomes),
+                "active": st.active,
+                "retry_in": retry_in,
+            })
+        rows.sort(key=lambda r: (r["state"] == CLOSED, -r["error_rate"], r["domain"]))
+        return rows
+
+
+domain_guard = DomainGuard()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from database.db_setup import async_session
+from database.models import GlobalSetting, Product, PriceHistory
+
+MEMORY_MAX_ITEMS = 500
+DEFAULT_TTL_MIN = 60          # если в GlobalSetting нет cache_ttl_<домен> / cache_ttl_default
+TTL_SETTINGS_REFRESH = 300    # как часто перечитывать TTL из базы (сек)
+
+
+def url_hash(url_key: str) -> str:
+    """Ключ товара в индексе: sha1 канонического URL."""
+    return hashlib.sha1(url_key.encode("utf-8")).hexdigest()
+
+
+class ProductInfoCache:
+    """
+    Индекс разобранных товаров, он же двухуровневый кеш парсера:
+    1) LRU в памяти (быстро, ограничен по размеру),
+    2) таблица products в SQLite (переживает перезапуск бота) + история цен price_history.
+    Каждый удачный парсинг обновляет товар в индексе и добавляет точку в историю цен.
+    Пока запись свежая (TTL в минутах через GlobalSetting: cache_ttl_<домен> или cache_ttl_default),
+    бот отвечает из индекса без парсинга; при TTL 0 индекс и история ведутся, но не отвечают.
+    """
+
+    def __init__(self, max_items: int = MEMORY_MAX_ITEMS):
+        self.max_items = max_items
+        self._memory = OrderedDict()   # url_key -> (expires_at: datetime, result: dict)
+        self._ttl = {}
+        self._ttl_loaded_at = 0.0
+
+    async def get(self, url_key: str):
+        now = datetime.now()
+
+        entry = self._memory.get(url_key)
+        if entry:
+            expires_at, result = entry
+            if expires_at > now:
+                self._memory.move_to_end(url_key)
+                return result
+            del self._memory[url_key]
+
+        try:
+            async with async_session() as session:
+                res = await session.execute(
+                    select(Product).where(Product.url_hash == url_hash(url_key), Product.expires_at > now)
+                )
+                row = res.scalar_one_or_none()
+        except Exception as e:
+            print(f"⚠️ [CACHE] Ошибка чтения: {e}")
+            return None
+
+        if not row:
+            return None
+        result = json.loads(row.payload)
+        self._remember(url_key, row.expires_at, result)
+        return result
+
+    async def set(self, url_key: str, domain: str, result: dict):
+        """Записывает удачный результат в индекс и историю цен."""
+        ttl_min = await self.ttl_for(domain)
+        now = datetime.now()
+        expires_at = now + timedelta(minutes=max(ttl_min, 0))
+        if ttl_min > 0:
+            self._remember(url_key, expires_at, result)
+
+        try:
+            price = float(result["price"])
+        except (KeyError, TypeError, ValueError):
+            return
+        payload = json.dumps(result, ensure_ascii=False)
+        fields = dict(
+            domain=domain, title=result.get("title"), image_url=result.get("image"), price=price,
+            currency=result.get("currency"), payload=payload, expires_at=expires_at, last_parsed_at=now,
+        )
+        try:
+            async with async_session() as session:
+                stmt = insert(Product).values(url_hash=url_hash(url_key), url=url_key, first_seen_at=now, **fields)
+                stmt = stmt.on_conflict_do_update(index_elements=['url_hash'], set_=fields)
+                stmt = stmt.returning(Product.id)
+                product_id = (await session.execute(stmt)).scalar_one()
+                session.add(PriceHistory(
+                    product_id=product_id, price=price, currency=result.get("currency"), observed_at=now
+                ))
+                await session.commit()
+        except Exception as e:
+            print(f"⚠️ [CACHE] Ошибка записи: {e}")
+
+    async def price_trend(self, url_key: str, limit: int = 15):
+        """Товар из индекса и его последние цены (новые первыми) — без повторного парсинга. None — не видели."""
+        try:
+            async with async_session() as session:
+                res = await session.execute(select(Product).where(Product.url_hash == url_hash(url_key)))
+                product = res.scalar_one_or_none()
+                if not product:
+                    return None
+                res = await session.execute(
+                    select(PriceHistory).where(PriceHistory.product_id == product.id)
+                    .order_by(PriceHistory.observed_at.desc()).limit(limit)
+                )
+                return product, res.scalars().all()
+        except Exception as e:
+            print(f"⚠️ [CACHE] Ошибка чтения истории цен: {e}")
+            return None
+
+    async def ttl_for(self, domain: str) -> float:
+        """TTL домена в минутах (настройки из базы перечитываются раз в TTL_SETTINGS_REFRESH сек)."""
+        if time.monotonic() - self._ttl_loaded_at > TTL_SETTINGS_REFRESH:
+            try:
+                async with async_session() as session:
+                    res = await session.execute(
+                        select(GlobalSetting).where(GlobalSetting.key.startswith("cache_ttl_"))
+                    )
+                    self._ttl = {s.key: s.value for s in res.scalars().all() if s.value is not None}
+            except Exception as e:
+                print(f"⚠️ [CACHE] Не удалось прочитать TTL: {e}")
+            self._ttl_loaded_at = time.monotonic()
+
+        for key in (f"cache_ttl_{domain}", "cache_ttl_default"):
+            if key in self._ttl:
+                return self._ttl[key]
+        return DEFAULT_TTL_MIN
+
+    def reload_ttl(self):
+        """Сбросить кеш настроек TTL (после изменения из админки)."""
+        self._ttl_loaded_at = 0.0
+
+    def _remember(self, url_key, expires_at, result):
+        self._memory[url_key] = (expires_at, result)
+        self._memory.move_to_end(url_key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+
+product_cache = ProductInfoCache()
@@ -1,111 +1,312 @@
 import asyncio
-import re
-import json
-from playwright.async_api import async_playwright
+import time
+from urllib.parse import urljoin
 
+from parser import metrics
+from parser.blocking import apply_block_profile, record_block_stats, block_profile
+from parser.breaker import domain_guard, is_site_failure
+from parser.cache import product_cache
+from parser.extractors import (
+    extractor_registry, GENERIC_PRICE_SELECTORS, COLLECT_CANDIDATES_JS, collect_args, extract_from_candidates
+)
+from parser.normalize import detect_currency, clean_price, is_usable_price
+from parser.pool import browser_pool
+from parser.proxies import proxy_pool, playwright_proxy
+from parser.selector_stats import price_source_stats
+from parser.session_state import storage_states
+from parser.static import fetch_html, collect_static
+from parser.strategy import strategy_planner
+from parser.urls import canonical_url
+from parser.utils import get_domain
+from parser.waits import wait_for_price, record_time_to_price
+from parser.workers import parser_workers, ParserQueueFull
 
-async def get_product_info(url):
-    """
-    Оптимизированный парсер: высокая скорость + защита от блокировок.
-    """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        # Эмуляция реального пользователя
-        context = await browser.new_context(
-            viewport={'width': 1280, 'height': 800},
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-        )
-        page = await context.new_page()
-
-        # Ускоряем загрузку: отключаем картинки и шрифты при парсинге цены
-        await page.route("**/*.{png,jpg,jpeg,svg,woff,woff2}", lambda route: route.abort())
+# Сколько ссылок из одного сообщения парсим одновременно
+BATCH_CONCURRENCY = 3
+
+# Заглушка, когда название товара не найдено
+NO_TITLE = "Назва не знайдена"
+
+# Парсинги «в полёте»: канонический URL -> задача. Одинаковые ссылки ждут одну задачу.
+_inflight = {}
+# Отправка частичных карточек идёт фоном; держим ссылки, чтобы задачи не собрал GC
+_partial_tasks = set()
+
+
+def _build_result(url, title, price_raw, image, strategy, price_source=None):
+    price = clean_price(price_raw)
+    return {
+        "title": (title or NO_TITLE).strip(),
+        "price": price,
+        "currency": detect_currency(price_raw, url),
+        "image": urljoin(url, image) if image else None,
+        "url": url,
+        "strategy": strategy,
+        "price_source": price_source,
+    }
+
+
+async def _parse_static(url, rules, proxy=None):
+    """Быстрый путь: обычный HTTP-запрос и разбор серверного HTML, без браузера."""
+    try:
+        html = await fetch_html(url, proxy)
+    except Exception:
+        return None
+    if not html:
+        return None
+    data = extract_from_candidates(collect_static(html, collect_args(rules)), rules)
+    result = _build_result(url, data["title"], data["price_raw"], data["image"], "http", data["price_source"])
+    result["net"] = {"transferred_bytes": len(html.encode("utf-8", errors="ignore")), "round_trips": 0}
+    return result
+
+
+def _partial_emitter(on_partial):
+    """Обёртка над on_partial: карточка без цены отправляется не больше одного раза и только с названием."""
+    if on_partial is None:
+        return None
+    fired = False
+
+    async def emit(url, data):
+        nonlocal fired
+        if fired or not data.get("title") or data["title"].strip() == NO_TITLE:
+            return
+        fired = True
+        # Фоном: on_partial в боте качает фото и пишет в Telegram — страница тем временем ждёт цену дальше
+        task = asyncio.create_task(_deliver_partial(on_partial, {
+            "title": data["title"].strip(),
+            "image": urljoin(url, data["image"]) if data.get("image") else None,
+        }))
+        _partial_tasks.add(task)
+        task.add_done_callback(_partial_tasks.discard)
+
+    return emit
 
+
+async def _deliver_partial(on_partial, data):
+    try:
+        await on_partial(data)
+    except Exception as e:
+        print(f"⚠️ [PARSER] Не удалось отдать частичный результат: {e}")
+
+
+async def _parse_browser(url, domain, rules, allow, emit=None, proxy=None):
+    """Полный путь: страница из пула браузеров, ждём цену и достаём её из DOM."""
+    # Cookies/localStorage магазина с прошлых визитов: баннеры и антибот уже пройдены (parser/session_state.py)
+    state = storage_states.load(domain)
+    async with browser_pool.page(storage_state=state, proxy=playwright_proxy(proxy)) as page:
+        # Ускоряем загрузку: режем картинки, стили, шрифты, видео, трекеры и рекламу (parser/blocking.py)
+        net = await apply_block_profile(page, domain, allow)
+
+        trips = 0  # вызовы в браузер (goto / ожидание / evaluate) — для бенчмарка и отчёта
         try:
             # Переход на страницу
-            await page.goto(url, wait_until="domcontentloaded", timeout=45000)
-
-            # Короткая пауза для подгрузки JS-цен (для Columbia достаточно 3-4 сек в headless режиме)
-            await asyncio.sleep(4)
-
-            # 1. Извлечение заголовка (через Meta или Title)
-            title = await page.title()
-            og_title = await page.get_attribute('meta[property="og:title"]', "content")
-            final_title = og_title or title or "Назва не знайдена"
-
-            # 2. Извлечение изображения
-            image = await page.get_attribute('meta[property="og:image"]', "content")
-
-            # 3. Поиск цены (Приоритетная логика)
-            price_raw = None
-
-            # --- Специфика магазинов ---
-            if "columbia.com" in url:
-                price_raw = await page.inner_text('.price-sales .value') or await page.inner_text('.price-sales')
-            elif "6pm.com" in url:
-                price_raw = await page.inner_text('span.price.sale') or await page.inner_text(
-                    '[data-test="product-price"]')
-
-            # --- Общие селекторы (если специфика не сработала) ---
-            if not price_raw:
-                selectors = [
-                    'span[data-test*="price-reduced"]', '.price-new', '.special-price',
-                    'span[data-test*="price"]', '.product-price', '.current-price', 'span.money'
-                ]
-                for s in selectors:
-                    try:
-                        el = await page.query_selector(s)
-                        if el:
-                            price_raw = await el.inner_text()
-                            if price_raw: break
-                    except:
-                        continue
-
-            # --- Поиск в JSON-LD (если селекторы подвели) ---
-            if not price_raw:
-                scripts = await page.query_selector_all('script[type="application/ld+json"]')
-                for script in scripts:
-                    try:
-                        data = json.loads(await script.inner_text())
-                        if isinstance(data, dict):
-                            offers = data.get('offers')
-                            if isinstance(offers, dict):
-                                price_raw = str(offers.get('price'))
-                            elif isinstance(offers, list):
-                                price_raw = str(offers[0].get('price'))
-                    except:
-                        continue
-
-            # 4. Детекция валюты
-            detected_currency = "USD"
-            price_str = str(price_raw).lower() if price_raw else ""
-
-            if any(x in price_str for x in ["грн", "uah", "₴"]) or ".ua" in url:
-                detected_currency = "UAH"
-            elif "€" in price_str or "eur" in price_str:
-                detected_currency = "EUR"
-            elif "£" in price_str or "gbp" in price_str:
-                detected_currency = "GBP"
-
-            # 5. Чистка цены (только цифры и точка)
-            clean_price = "0.0"
-            if price_raw:
-                # Убираем всё кроме цифр, точек и запятых
-                nums = re.sub(r"[^\d\.,]", "", str(price_raw)).replace(',', '.')
-                # Если точек несколько (ошибка парсинга), оставляем только последнюю
-                if nums.count('.') > 1:
-                    parts = nums.split('.')
-                    nums = "".join(parts[:-1]) + "." + parts[-1]
-                clean_price = nums if nums else "0.0"
-
-            return {
-                "title": final_title.strip(),
-                "price": clean_price,
-                "currency": detected_currency,
-                "image": image,
-                "url": url
-            }
+            started = time.monotonic()
+            trips += 1
+            response = await page.goto(url, wait_until="domcontentloaded", timeout=45000)
+
+            # Название и фото обычно уже есть — отдаём их, не дожидаясь цены
+            if emit:
+                trips += 1
+                early = await page.evaluate(COLLECT_CANDIDATES_JS, collect_args(dict(rules, price=[])))
+                await emit(url, extract_from_candidates(early))
+
+            # Ждём не фиксированные 4 сек, а первый признак цены (с пределом, выученным для домена)
+            trips += 1
+            waited = await wait_for_price(page, domain, rules["price"])
+
+            # 1-3. Все кандидаты (meta, селекторы магазина, JSON-LD) одним вызовом page.evaluate,
+            # а выбор и нормализация — уже в Python
+            trips += 1
+            payload = await page.evaluate(COLLECT_CANDIDATES_JS, collect_args(rules))
+            data = extract_from_candidates(payload, rules)
+
+            # 4-5. Валюта и чистка цены
+            result = _build_result(url, data["title"], data["price_raw"], data["image"], "browser",
+                                   data["price_source"])
+            ok = is_usable_price(result["price"])
+            if ok:
+                record_time_to_price(domain, waited, time.monotonic() - started)
+                if storage_states.needs_refresh(domain):
+                    trips += 1
+                    storage_states.save(domain, await page.context.storage_state())
+            storage_states.record(domain, ok, used_state=bool(state))
+            result["net"] = dict(net, round_trips=trips)
+            if response is not None and response.status >= 400:
+                # Для предохранителя: 403/429 без цены — магазин нас не пускает (parser/breaker.py)
+                result["http_status"] = response.status
+            return result
 
         except Exception as e:
-            return {"error": f"Парсинг не удался: {str(e)}"}
+            storage_states.record(domain, False, used_state=bool(state))
+            return {"error": f"Парсинг не удался: {str(e)}", "net": dict(net, round_trips=trips)}
         finally:
-            await browser.close()
+            record_block_stats(domain, net)
+            metrics.incr("browser_round_trips", domain, trips)
+
+
+async def parse_uncached(url, domain, rules, allow, mode="http", on_partial=None, proxy=None):
+    """
+    Парсинг без кеша. mode (см. parser/strategy.py):
+    "http" — сначала HTTP, при неудаче браузер; "browser" — сразу браузер;
+    "race" — оба пути одновременно, побеждает первый результат с ценой, проигравший отменяется.
+    on_partial({"title", "image"}) вызывается, как только известны название и фото, а цены ещё нет.
+    proxy — адрес прокси, уже выбранный из пула (parser/proxies.py), для обоих путей.
+    Не обращается к базе (правила и исключения блокировки приходят аргументами),
+    поэтому одинаково работает и в цикле бота, и в процессе-воркере (parser/workers.py).
+    """
+    emit = _partial_emitter(on_partial)
+    if mode == "race":
+        return await _race(url, domain, rules, set(allow), emit, proxy)
+
+    if mode != "browser":
+        result = await _parse_static(url, rules, proxy)
+        if result and is_usable_price(result["price"]):
+            metrics.incr("strategy_http", domain)
+            return result
+        if result and emit:
+            await emit(url, result)
+
+    metrics.incr("strategy_browser", domain)
+    return await _parse_browser(url, domain, rules, set(allow), emit, proxy)
+
+
+async def _race(url, domain, rules, allow, emit=None, proxy=None):
+    """HTTP и браузер наперегонки: ждём первый результат с ценой, второй путь отменяем."""
+    metrics.incr("race_started", domain)
+    tasks = {
+        asyncio.ensure_future(_parse_static(url, rules, proxy)),
+        asyncio.ensure_future(_parse_browser(url, domain, rules, allow, emit, proxy)),
+    }
+    fallback = None
+    try:
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                result = {"error": f"Парсинг не удался: {error}"} if error else task.result()
+                if result and "error" not in result and is_usable_price(result["price"]):
+                    metrics.incr(f"strategy_{result['strategy']}", domain)
+                    metrics.incr(f"race_won_{result['strategy']}", domain)
+                    return result
+                # Без цены: оставляем на случай, если и второй путь ничего не найдёт (ошибка браузера важнее)
+                if result and (fallback is None or "error" in result):
+                    fallback = result
+                if result and "error" not in result and emit:
+                    await emit(url, result)
+        return fallback or {"error": "Парсинг не удался: цена не найдена"}
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def get_product_info(url, force_refresh=False, on_queued=None, on_partial=None):
+    """
+    Оптимизированный парсер: высокая скорость + защита от блокировок.
+    Сначала смотрим кеш (по каноническому URL), затем пробуем обычный HTTP
+    (многие магазины отдают og-теги и JSON-LD прямо в HTML), и только если цены там нет —
+    открываем страницу из общего пула браузеров (parser/pool.py). Для доменов, где ещё неизвестно,
+    какой путь нужен, оба запускаются одновременно (гонка, parser/strategy.py).
+    В результате поле "strategy" показывает, какой путь сработал: "http" или "browser".
+    force_refresh=True — игнорировать кеш (принудительное обновление из админки).
+    Одновременные запросы одной и той же ссылки делят один парсинг (и один результат или ошибку).
+    Сам парсинг идёт в процессах-воркерах; если очередь занята, вызывается
+    on_queued(позиция, ожидание_сек), а при переполнении очереди — ParserQueueFull.
+    on_partial({"title", "image"}) — карточка без цены, пока цена ещё ищется (только для первого из ждущих).
+    """
+    domain = get_domain(url)
+    url_key = canonical_url(url)
+
+    if not force_refresh:
+        cached = await product_cache.get(url_key)
+        if cached:
+            metrics.incr("cache_hit", domain)
+            return dict(cached, url=url, cached=True)
+        metrics.incr("cache_miss", domain)
+
+    task = _inflight.get(url_key)
+    if task is not None:
+        metrics.incr("singleflight_saved", domain)
+    else:
+        task = asyncio.ensure_future(_parse_and_cache(url, domain, url_key, on_queued, on_partial))
+        _inflight[url_key] = task
+        task.add_done_callback(lambda t: _forget_inflight(url_key, t))
+
+    # shield: если один из ждущих отменён, общий парсинг продолжается для остальных
+    result = await asyncio.shield(task)
+    return dict(result, url=url)
+
+
+async def _parse_and_cache(url, domain, url_key, on_queued=None, on_partial=None):
+    # Магазин лежит или блокирует нас — не держим пул 45 секунд, сразу отдаём «проверит менеджер»
+    if not domain_guard.allow(domain):
+        return {"error": "Магазин временно недоступен для автопроверки", "breaker": True}
+
+    # Одна выборка из реестра по домену; общий каскад селекторов — только если своих правил нет
+    rules = dict(await extractor_registry.rules_for(url) or {})
+    rules["price"] = rules.get("price") or GENERIC_PRICE_SELECTORS
+    # Источник, который чаще всего давал цену на этом домене, пробуем первым
+    rules["price"], rules["source_order"] = await price_source_stats.order(domain, rules["price"])
+    allow = sorted(await block_profile.allow_for(domain))
+    # Для незнакомых доменов — гонка HTTP и браузера, для изученных — сразу победитель
+    mode = await strategy_planner.choose(domain)
+
+    try:
+        if parser_workers.enabled:
+            # Лимит страниц на домен и прокси берёт очередь воркеров (parser/workers.py) — в момент, когда
+            # задача из неё выходит: пока ссылка ждёт, она не держит ни слот домена, ни прокси
+            result = await parser_workers.submit(url, domain, rules, allow, mode, on_queued, on_partial)
+        else:
+            async with domain_guard.slot(domain), proxy_pool.use() as proxy:
+                started = time.monotonic()
+                result = await parse_uncached(url, domain, rules, allow, mode, on_partial, proxy and proxy.url)
+                await proxy_pool.record_result(proxy, result, time.monotonic() - started)
+    except ParserQueueFull:
+        # Перегружены мы, а не магазин — предохранитель не трогаем
+        domain_guard.forget_trial(domain)
+        raise
+    except Exception:
+        domain_guard.record(domain, False)
+        raise
+
+    ok = "error" not in result and is_usable_price(result["price"])
+    domain_guard.record(domain, not is_site_failure(result))
+    if ok and result.get("price_source"):
+        await price_source_stats.record(domain, result["price_source"])
+    if not result.get("internal"):
+        # Наш таймаут или перезапуск воркера ничего не говорит о том, какой путь парсинга лучше
+        await strategy_planner.record(domain, mode, result)
+    if ok:
+        await product_cache.set(url_key, domain, result)
+    return result
+
+
+def _forget_inflight(url_key, task):
+    if _inflight.get(url_key) is task:
+        del _inflight[url_key]
+    if not task.cancelled():
+        task.exception()  # помечаем ошибку как полученную, даже если все ждущие отменены
+
+
+async def get_products_info(urls, force_refresh=False, concurrency=BATCH_CONCURRENCY):
+    """
+    Пакетный парсинг (вишлист из нескольких ссылок): ссылки разбираются параллельно,
+    но не больше `concurrency` одновременно, чтобы один список не занял весь пул браузеров.
+    Дубликаты (по каноническому URL) отбрасываются, порядок ссылок сохраняется.
+    Возвращает список результатов в том же формате, что get_product_info.
+    """
+    unique = {}
+    for url in urls:
+        unique.setdefault(canonical_url(url), url)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def parse_one(url):
+        async with sem:
+            try:
+                return await get_product_info(url, force_refresh=force_refresh)
+            except ParserQueueFull:
+                return {"error": "Очередь парсинга переполнена", "busy": True, "url": url}
+            except Exception as e:
+                return {"error": f"Парсинг не удался: {str(e)}", "url": url}
+
+    return await asyncio.gather(*(parse_one(u) for u in unique.values()))
@@ -0,0 +1,189 @@
+import asyncio
+import json
+
+from sqlalchemy import select, or_
+
+from database.db_setup import async_session
+from database.models import SiteSetting
+from parser.normalize import jsonld_offer_price
+from parser.utils import get_domain
+
+# Встроенные правила (если для домена нет своих селекторов в SiteSetting)
+BUILTIN_RULES = {
+    "columbia.com": {"price": ['.price-sales .value', '.price-sales']},
+    "6pm.com": {"price": ['span.price.sale', '[data-test="product-price"]']},
+}
+
+# Общий каскад селекторов цены — только для доменов без своих правил
+GENERIC_PRICE_SELECTORS = [
+    'span[data-test*="price-reduced"]', '.price-new', '.special-price',
+    'span[data-test*="price"]', '.product-price', '.current-price', 'span.money'
+]
+
+# Мета-теги, которые нужны парсеру
+META_KEYS = [
+    "og:title", "og:image", "og:price:amount", "og:price:currency",
+    "product:price:amount", "product:price:currency",
+]
+
+# Один скрипт в браузере собирает всех кандидатов сразу (один round-trip вместо десятка)
+COLLECT_CANDIDATES_JS = """
+(rules) => {
+    const first = (s) => { try { return document.querySelector(s); } catch (e) { return null; } };
+    const text = (el) => el ? ((el.innerText || el.textContent || '').trim() || null) : null;
+    const meta = {};
+    for (const key of rules.meta) {
+        const el = document.querySelector(`meta[property="${key}"], meta[name="${key}"]`);
+        if (el) meta[key] = el.getAttribute('content');
+    }
+    return {
+        title: document.title,
+        meta: meta,
+        name: rules.name.map(s => text(first(s))),
+        price: rules.price.map(s => { const el = first(s); return el ? (text(el) || el.getAttribute('content')) : null; }),
+        image: rules.image.map(s => {
+            const el = first(s);
+            return el ? (el.getAttribute('content') || el.getAttribute('src') || el.getAttribute('data-src')) : null;
+        }),
+        jsonld: Array.from(document.querySelectorAll('script[type="application/ld+json"]')).map(s => s.textContent),
+    };
+}
+"""
+
+
+def collect_args(rules: dict) -> dict:
+    """Аргумент для COLLECT_CANDIDATES_JS (и для статического сборщика)."""
+    return {
+        "name": rules.get("name", []),
+        "price": rules.get("price", []),
+        "image": rules.get("image", []),
+        "meta": META_KEYS,
+    }
+
+
+# Источники цены в порядке по умолчанию; для домена порядок подстраивается по статистике (parser/selector_stats.py)
+PRICE_SOURCES = ("css", "jsonld", "og")
+
+
+def _first(values):
+    return next((v.strip() for v in values or [] if v and v.strip()), None)
+
+
+def _price_from_css(payload, meta, selectors):
+    for selector, value in zip(selectors, payload.get("price") or []):
+        if value and value.strip():
+            return value.strip(), f"css:{selector}"
+    return None, None
+
+
+def _price_from_jsonld(payload, meta, selectors):
+    for raw in payload.get("jsonld") or []:
+        try:
+            price_raw = jsonld_offer_price(json.loads(raw or "", strict=False))
+        except ValueError:
+            continue
+        if price_raw:
+            return price_raw, "jsonld"
+    return None, None
+
+
+def _price_from_og(payload, meta, selectors):
+    amount = meta.get("og:price:amount") or meta.get("product:price:amount")
+    currency = meta.get("og:price:currency") or meta.get("product:price:currency")
+    if not amount:
+        return None, None
+    return (f"{amount} {currency}" if currency else amount), "og"
+
+
+_PRICE_READERS = {"css": _price_from_css, "jsonld": _price_from_jsonld, "og": _price_from_og}
+
+
+def extract_from_candidates(payload: dict, rules: dict = None) -> dict:
+    """
+    Выбирает заголовок, картинку и «сырую» цену из собранных кандидатов.
+    Порядок: селекторы магазина -> og-теги/title; для цены: селекторы -> JSON-LD offers -> og:price
+    (или rules["source_order"], если для домена выучен другой порядок).
+    price_source — откуда взята цена: "css:<селектор>", "jsonld" или "og".
+    """
+    rules = rules or {}
+    meta = payload.get("meta") or {}
+
+    title = _first(payload.get("name")) or meta.get("og:title") or payload.get("title")
+    image = _first(payload.get("image")) or meta.get("og:image")
+
+    price_raw = price_source = None
+    for kind in rules.get("source_order") or PRICE_SOURCES:
+        price_raw, price_source = _PRICE_READERS[kind](payload, meta, rules.get("price") or [])
+        if price_raw:
+            break
+
+    return {"title": title, "image": image, "price_raw": price_raw, "price_source": price_source}
+
+
+def split_selectors(value) -> list:
+    """В поле SiteSetting можно указать несколько селекторов: по одному на строку или через ';'."""
+    if not value:
+        return []
+    return [s.strip() for s in value.replace(";", "\n").splitlines() if s.strip()]
+
+
+class ExtractorRegistry:
+    """
+    Правила извлечения (селекторы name/price/image), проиндексированные по домену.
+    Строится из SiteSetting при первом обращении и после invalidate() (правка сайта в админке).
+    """
+
+    def __init__(self):
+        self._rules = None   # домен -> {"name": [...], "price": [...], "image": [...]}
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._rules = None
+
+    async def _rebuild(self):
+        rules = {domain: dict(rule) for domain, rule in BUILTIN_RULES.items()}
+        try:
+            async with async_session() as session:
+                res = await session.execute(
+                    select(SiteSetting).where(or_(
+                        SiteSetting.name_selector != None,
+                        SiteSetting.price_selector != None,
+                        SiteSetting.image_selector != None,
+                    ))
+                )
+                sites = res.scalars().all()
+        except Exception as e:
+            print(f"⚠️ [PARSER] Не удалось загрузить селекторы сайтов: {e}")
+            sites = []
+
+        for site in sites:
+            domain = (site.domain or get_domain(site.url or "")).lower().removeprefix("www.")
+            if not domain:
+                continue
+            rule = {
+                "name": split_selectors(site.name_selector),
+                "price": split_selectors(site.price_selector),
+                "image": split_selectors(site.image_selector),
+            }
+            rules[domain] = {k: v for k, v in rule.items() if v}
+
+        self._rules = {domain: rule for domain, rule in rules.items() if rule}
+        print(f"🧩 [PARSER] Реестр экстракторов: {len(self._rules)} доменов с правилами")
+
+    async def rules_for(self, url: str):
+        """Правила для ссылки: точный домен, затем родительский (m.shop.com -> shop.com). None — правил нет."""
+        if self._rules is None:
+            async with self._lock:
+                if self._rules is None:
+                    await self._rebuild()
+
+        domain = get_domain(url)
+        while "." in domain:
+            rule = self._rules.get(domain)
+            if rule:
+                return rule
+            domain = domain.split(".", 1)[1]
+        return None
+
+
+extractor_registry = ExtractorRegistry()
@@ -0,0 +1,72 @@
+from collections import defaultdict, deque
+
+# Сколько последних замеров храним на каждый домен
+SAMPLE_WINDOW = 50
+
+# (метрика, домен) -> счётчик / последние замеры
+_counters = defaultdict(int)
+_samples = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+
+# В процессе-воркере события дополнительно копятся здесь и уходят в главный процесс вместе с результатом
+_outbox = None
+
+
+def incr(name: str, domain: str = "*", n: int = 1):
+    _counters[(name, domain)] += n
+    if _outbox is not None:
+        _outbox.append(("incr", name, domain, n))
+
+
+def observe(name: str, domain: str, value: float):
+    _samples[(name, domain)].append(value)
+    if _outbox is not None:
+        _outbox.append(("observe", name, domain, value))
+
+
+def enable_forwarding():
+    global _outbox
+    _outbox = []
+
+
+def drain() -> list:
+    """Забрать накопленные события (в воркере)."""
+    events = list(_outbox or ())
+    if _outbox:
+        _outbox.clear()
+    return events
+
+
+def apply(events):
+    """Применить события, пришедшие из воркера (в главном процессе)."""
+    for kind, name, domain, value in events:
+        if kind == "incr":
+            _counters[(name, domain)] += value
+        else:
+            _samples[(name, domain)].append(value)
+
+
+def samples(name: str, domain: str) -> list:
+    return list(_samples.get((name, domain), ()))
+
+
+def percentile(values, q: float) -> float:
+    """Перцентиль без numpy (q от 0 до 1)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def report() -> dict:
+    """Снимок всех метрик парсера по доменам (для логов и админки)."""
+    result = defaultdict(dict)
+    for (name, domain), value in _counters.items():
+        result[domain][name] = value
+    for (name, domain), values in _samples.items():
+        if values:
+            result[domain][name] = {
+                "n": len(values),
+                "p50": round(percentile(values, 0.5), 2),
+                "p90": round(percentile(values, 0.9), 2),
+            }
+    return dict(result)
@@ -0,0 +1,61 @@
+import re
+
+
+def detect_currency(price_raw, url: str) -> str:
+    """Детекция валюты по тексту цены и домену."""
+    price_str = str(price_raw).lower() if price_raw else ""
+
+    if any(x in price_str for x in ["грн", "uah", "₴"]) or ".ua" in url:
+        return "UAH"
+    elif "€" in price_str or "eur" in price_str:
+        return "EUR"
+    elif "£" in price_str or "gbp" in price_str:
+        return "GBP"
+    return "USD"
+
+
+def clean_price(price_raw) -> str:
+    """Чистка цены (только цифры и точка)."""
+    if not price_raw:
+        return "0.0"
+    # Убираем всё кроме цифр, точек и запятых
+    nums = re.sub(r"[^\d\.,]", "", str(price_raw)).replace(',', '.')
+    # Если точек несколько (ошибка парсинга), оставляем только последнюю
+    if nums.count('.') > 1:
+        parts = nums.split('.')
+        nums = "".join(parts[:-1]) + "." + parts[-1]
+    return nums if nums else "0.0"
+
+
+def is_usable_price(price: str) -> bool:
+    try:
+        return float(price) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def jsonld_offer_price(data):
+    """Ищет offers.price в JSON-LD (dict, список или @graph). Возвращает строку или None."""
+    if isinstance(data, list):
+        for entry in data:
+            price = jsonld_offer_price(entry)
+            if price:
+                return price
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    if "@graph" in data:
+        return jsonld_offer_price(data["@graph"])
+
+    offers = data.get('offers')
+    if isinstance(offers, list) and offers:
+        offers = offers[0]
+    if isinstance(offers, dict):
+        price = offers.get('price') or offers.get('lowPrice')
+        if price is None and isinstance(offers.get('priceSpecification'), dict):
+            price = offers['priceSpecification'].get('price')
+        if price is not None:
+            currency = offers.get('priceCurrency')
+            return f"{price} {currency}" if currency else str(price)
+    return None
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import uuid
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright
+
+# --- НАСТРОЙКИ ПУЛА (можно переопределить через .env) ---
+POOL_BROWSERS = int(os.getenv("PARSER_POOL_BROWSERS", 2))
+POOL_CONTEXTS_PER_BROWSER = int(os.getenv("PARSER_POOL_CONTEXTS", 3))
+POOL_MAX_PAGES_PER_BROWSER = int(os.getenv("PARSER_POOL_MAX_PAGES", 150))
+POOL_MAX_RSS_MB = int(os.getenv("PARSER_POOL_MAX_RSS_MB", 900))
+# Замер памяти делаем не на каждой странице, а раз в N страниц
+RSS_CHECK_EVERY = 10
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+VIEWPORT = {'width': 1280, 'height': 800}
+
+
+def _process_tree_rss_mb(marker: str) -> float:
+    """RSS (МБ) браузера с нашим маркером и всех его дочерних процессов. Работает только на Linux (/proc)."""
+    try:
+        pids = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return 0.0
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    children, rss, root = {}, {}, None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                stat = f.read()
+            comm = stat[stat.find("(") + 1:stat.rfind(")")]
+            fields = stat[stat.rfind(")") + 2:].split()
+            ppid, rss_pages = int(fields[1]), int(fields[21])
+            if root is None and ("chrom" in comm or "headless" in comm):
+                with open(f"/proc/{pid}/cmdline", "rb") as f:
+                    if marker.encode() in f.read():
+                        root = int(pid)
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(pid))
+        rss[int(pid)] = rss_pages * page_size
+
+    if root is None:
+        return 0.0
+
+    total, stack = 0, [root]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total / (1024 * 1024)
+
+
+class _BrowserSlot:
+    """Один процесс Chromium с набором «тёплых» контекстов."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.browser = None
+        self.marker = f"--alina-pool-slot={uuid.uuid4().hex}"
+        self.idle_contexts = []
+        self.active = 0
+        self.pages_served = 0
+        self.retiring = False
+
+
+class BrowserPool:
+    """
+    Долгоживущий пул браузеров для парсера.
+    Раздаёт готовые страницы, ограничивает число одновременных вкладок
+    и перезапускает браузер после N страниц или при превышении лимита памяти.
+    """
+
+    def __init__(self, size: int = POOL_BROWSERS, contexts_per_browser: int = POOL_CONTEXTS_PER_BROWSER,
+                 max_pages: int = POOL_MAX_PAGES_PER_BROWSER, max_rss_mb: int = POOL_MAX_RSS_MB):
+        self.size = size
+        self.contexts_per_browser = contexts_per_browser
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self._pw = None
+        self._slots = []
+        self._draining = set()
+        self._sem = None
+        self._lock = asyncio.Lock()
+        self._started = False
+
+    async def start(self):
+        async with self._lock:
+            if self._started:
+                return
+            self._pw = await async_playwright().start()
+            self._slots = []
+            for i in range(self.size):
+                self._slots.append(await self._launch(_BrowserSlot(i)))
+            self._sem = asyncio.Semaphore(self.size * self.contexts_per_browser)
+            self._started = True
+        print(f"🌐 [POOL] Запущено браузеров: {self.size} (до {self.contexts_per_browser} вкладок в каждом)")
+
+    async def stop(self):
+        async with self._lock:
+            if not self._started:
+                return
+            slots = self._slots + list(self._draining)
+            self._slots, self._draining = [], set()
+            self._started = False
+        for slot in slots:
+            await self._close_slot(slot)
+        await self._pw.stop()
+        self._pw = None
+        print("🔌 [POOL] Пул браузеров остановлен.")
+
+    async def _launch(self, slot: _BrowserSlot) -> _BrowserSlot:
+        slot.browser = await self._pw.chromium.launch(headless=True, args=[slot.marker])
+        return slot
+
+    async def _close_slot(self, slot: _BrowserSlot):
+        try:
+            await slot.browser.close()
+        except Exception:
+            pass
+
+    async def _acquire_slot(self) -> _BrowserSlot:
+        async with self._lock:
+            # Упавший браузер сразу заменяем новым
+            for i, slot in enumerate(self._slots):
+                if not slot.browser.is_connected():
+                    self._slots[i] = await self._launch(_BrowserSlot(i))
+            slot = min(self._slots, key=lambda s: s.active)
+            slot.active += 1
+            return slot
+
+    async def _retire(self, slot: _BrowserSlot, reason: str):
+        """Ставит на место браузера свежий, а старый закрывает, когда его вкладки освободятся."""
+        async with self._lock:
+            if slot.retiring or self._slots[slot.index] is not slot:
+                return
+            slot.retiring = True
+            self._slots[slot.index] = await self._launch(_BrowserSlot(slot.index))
+            self._draining.add(slot)
+        print(f"♻️ [POOL] Браузер #{slot.index} перезапущен: {reason}")
+        if slot.active == 0:
+            self._draining.discard(slot)
+            await self._close_slot(slot)
+
+    @asynccontextmanager
+    async def page(self, storage_state=None, proxy=None):
+        """
+        Выдаёт страницу из пула: `async with browser_pool.page() as page: ...`
+        storage_state (cookies + localStorage магазина) или proxy (словарь Playwright, см. parser/proxies.py) —
+        страница в отдельном контексте с ними; такой контекст закрывается после использования, а не возвращается в пул.
+        """
+        dedicated = bool(storage_state or proxy)
+        if not self._started:
+            await self.start()
+
+        await self._sem.acquire()
+        slot = context = None
+        try:
+            slot = await self._acquire_slot()
+            if dedicated:
+                context = await slot.browser.new_context(
+                    viewport=VIEWPORT, user_agent=USER_AGENT, storage_state=storage_state, proxy=proxy
+                )
+            elif slot.idle_contexts:
+                context = slot.idle_contexts.pop()
+            else:
+                context = await slot.browser.new_context(viewport=VIEWPORT, user_agent=USER_AGENT)
+            page = await context.new_page()
+        except BaseException:
+            if context is not None:
+                await self._drop_or_keep(slot, context, dedicated)
+            if slot is not None:
+                slot.active -= 1
+            self._sem.release()
+            raise
+
+        try:
+            yield page
+        finally:
+            await self._release(slot, context, page, dedicated=dedicated)
+
+    async def _drop_or_keep(self, slot: _BrowserSlot, context, dedicated: bool):
+        if dedicated:
+            try:
+                await context.close()
+            except Exception:
+                pass
+        else:
+            slot.idle_contexts.append(context)
+
+    async def _release(self, slot: _BrowserSlot, context, page, dedicated: bool = False):
+        try:
+            await page.close()
+        except Exception:
+            pass
+        if dedicated:
+            await self._drop_or_keep(slot, context, True)
+
+        slot.active -= 1
+        slot.pages_served += 1
+        self._sem.release()
+
+        if slot.retiring:
+            # Контексты старого браузера больше не нужны
+            if slot.active == 0 and slot in self._draining:
+                self._draining.discard(slot)
+                await self._close_slot(slot)
+            return
+
+        if not dedicated:
+            slot.idle_contexts.append(context)
+
+        if slot.pages_served >= self.max_pages:
+            await self._retire(slot, f"обслужено {slot.pages_served} страниц")
+        elif slot.pages_served % RSS_CHECK_EVERY == 0:
+            rss_mb = await asyncio.to_thread(_process_tree_rss_mb, slot.marker)
+            if rss_mb > self.max_rss_mb:
+                await self._retire(slot, f"память {rss_mb:.0f} МБ > {self.max_rss_mb} МБ")
+
+
+# Общий пул на весь процесс бота
+browser_pool = BrowserPool()
@@ -0,0 +1,393 @@
+import asyncio
+import hashlib
+import html
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import aiohttp
+from sqlalchemy import select, or_
+from sqlalchemy.dialects.sqlite import insert
+
+from database.db_setup import async_session
+from database.models import PromoScanState, Promotion, SiteSetting
+from parser.promo_text import DISCOUNT_RE, scan_page
+from parser.proxies import proxy_pool, BLOCK_STATUSES
+from parser.urls import canonical_url
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Referer': 'https://www.google.com/'
+}
+SCAN_TIMEOUT = 20               # сек на один сайт (как было у requests)
+SCAN_CONCURRENCY = 20           # одновременных запросов на весь скан
+SCAN_PER_HOST = 2               # и не больше стольких к одному хосту
+MAX_PAGE_BYTES = 3 * 1024 * 1024
+SCAN_PROXY_ATTEMPTS = 2         # заблокировали через один прокси — пробуем другой
+PROMO_TITLE_CHARS = 150
+
+# Период проверки каждого сайта подстраивается: изменилась страница — проверяем вдвое чаще,
+# не изменилась (или ошибка) — в SCAN_BACKOFF раз реже; плюс-минус SCAN_JITTER, чтобы сайты не шли пачкой
+SCAN_INTERVAL_DEFAULT = int(os.getenv("PROMO_SCAN_INTERVAL", 2 * 3600))
+SCAN_INTERVAL_MIN = int(os.getenv("PROMO_SCAN_INTERVAL_MIN", 15 * 60))
+SCAN_INTERVAL_MAX = int(os.getenv("PROMO_SCAN_INTERVAL_MAX", 24 * 3600))
+SCAN_BACKOFF = 1.5
+SCAN_JITTER = 0.15
+
+# Итоги последнего скана (для отчёта админу): сколько сайтов скачано, сколько пропущено без изменений
+last_scan_stats = {}
+
+# Сканы (ручной и планировщика) не пересекаются, чтобы не проверять один сайт дважды
+_scan_lock = asyncio.Lock()
+
+# Отдельная от парсера товаров сессия: свои заголовки и без проверки SSL (как было у requests, verify=False)
+_session = None
+
+
+def get_scanner_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers=HEADERS,
+            # Общий таймаут на сайт считаем сами (_fetch_via_pool). Очередь к хосту держит _scan_site своим
+            # семафором ещё до таймаута — limit_per_host здесь лишь страховка (например, для редиректов)
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=SCAN_TIMEOUT, sock_read=SCAN_TIMEOUT),
+            connector=aiohttp.TCPConnector(
+                limit=SCAN_CONCURRENCY, limit_per_host=SCAN_PER_HOST, ttl_dns_cache=300, ssl=False
+            ),
+        )
+    return _session
+
+
+async def close_scanner_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _load_active_sites(site_ids=None):
+    """Список активных сайтов (только site_ids, если заданы)."""
+    async with async_session() as session:
+        stmt = select(SiteSetting).where(
+            SiteSetting.is_active.in_([True, 1]),
+            SiteSetting.url != None,
+            SiteSetting.url != ""
+        )
+        if site_ids is not None:
+            stmt = stmt.where(SiteSetting.id.in_(site_ids))
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+
+async def _load_scan_states(site_ids) -> dict:
+    """Сохранённые валидаторы и хеши страниц: site_id -> PromoScanState."""
+    try:
+        async with async_session() as session:
+            res = await session.execute(select(PromoScanState).where(PromoScanState.site_id.in_(site_ids)))
+            return {row.site_id: row for row in res.scalars().all()}
+    except Exception as e:
+        print(f"⚠️ [SCANNER] Не удалось загрузить состояние прошлого скана: {e}")
+        return {}
+
+
+async def due_site_ids(limit: int) -> list:
+    """Активные сайты, которые пора проверить: ещё ни разу не проверенные и с наступившим next_run_at."""
+    stmt = (
+        select(SiteSetting.id)
+        .outerjoin(PromoScanState, PromoScanState.site_id == SiteSetting.id)
+        .where(
+            SiteSetting.is_active.in_([True, 1]),
+            SiteSetting.url != None,
+            SiteSetting.url != "",
+            or_(PromoScanState.next_run_at == None, PromoScanState.next_run_at <= datetime.now()),
+        )
+        .order_by(PromoScanState.next_run_at.is_not(None), PromoScanState.next_run_at)
+        .limit(limit)
+    )
+    async with async_session() as session:
+        res = await session.execute(stmt)
+        return list(res.scalars().all())
+
+
+def _schedule(prev, outcome: str, now: datetime):
+    """Новый период проверки и время следующей. outcome: "changed", "same" или "error"."""
+    interval = (prev.interval_sec if prev is not None else None) or SCAN_INTERVAL_DEFAULT
+    if outcome == "changed" and prev is not None:
+        interval /= 2
+    elif outcome in ("same", "error"):
+        interval *= SCAN_BACKOFF
+    interval = int(min(SCAN_INTERVAL_MAX, max(SCAN_INTERVAL_MIN, interval)))
+    delay = interval * random.uniform(1 - SCAN_JITTER, 1 + SCAN_JITTER)
+    return interval, now + timedelta(seconds=delay)
+
+
+def _state_row(item, prev, now: datetime, outcome: str, **fields) -> dict:
+    """Строка promo_scan_states: то, что не изменилось, берём из прошлого скана."""
+    row = dict(site_id=item.id, url=item.url, etag=None, last_modified=None, body_hash=None,
+               has_promo=False, promo_text=None, changed_at=None, entry_hashes=None)
+    if prev is not None:
+        row.update(etag=prev.etag, last_modified=prev.last_modified, body_hash=prev.body_hash,
+                   has_promo=prev.has_promo, promo_text=prev.promo_text, changed_at=prev.changed_at,
+                   entry_hashes=prev.entry_hashes)
+    row.update(fields, checked_at=now)
+    row["interval_sec"], row["next_run_at"] = _schedule(prev, outcome, now)
+    return row
+
+
+async def _save_scan_states(rows: list):
+    """Одним запросом обновляет состояние всех проверенных сайтов."""
+    if not rows:
+        return
+    try:
+        async with async_session() as session:
+            stmt = insert(PromoScanState).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['site_id'],
+                set_={col: stmt.excluded[col] for col in (
+                    "url", "etag", "last_modified", "body_hash", "has_promo", "promo_text", "last_status",
+                    "checked_at", "changed_at", "interval_sec", "next_run_at", "entry_hashes"
+                )}
+            )
+            await session.execute(stmt)
+            await session.commit()
+    except Exception as e:
+        print(f"⚠️ [SCANNER] Не удалось сохранить состояние скана: {e}")
+
+
+async def _fetch_page(url: str, proxy=None, etag=None, last_modified=None):
+    """
+    Условный GET (не больше MAX_PAGE_BYTES): If-None-Match / If-Modified-Since из прошлого скана.
+    Возвращает (статус, тело или None, ETag, Last-Modified); на 304 тела нет.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    async with get_scanner_session().get(url, proxy=proxy, headers=headers, allow_redirects=True) as resp:
+        validators = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        if resp.status != 200:
+            return resp.status, None, *validators
+        body = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            body += chunk
+            if len(body) >= MAX_PAGE_BYTES:
+                break
+        return resp.status, (bytes(body), resp.charset), *validators
+
+
+async def _fetch_via_pool(url: str, etag=None, last_modified=None):
+    """
+    _fetch_page через прокси из общего пула (parser/proxies.py) с оценкой прокси по итогу.
+    Если прокси заблокирован (403/407/429) или упал, одна повторная попытка через другой.
+    """
+    tried = []
+    while True:
+        async with proxy_pool.use(exclude=tried) as proxy:
+            started = time.monotonic()
+            retry = proxy is not None and len(tried) + 1 < SCAN_PROXY_ATTEMPTS
+            try:
+                page = await asyncio.wait_for(
+                    _fetch_page(url, proxy and proxy.url, etag, last_modified), SCAN_TIMEOUT
+                )
+            except Exception as e:
+                await proxy_pool.record(proxy, False, error=str(e) or type(e).__name__)
+                if not retry:
+                    raise
+                tried.append(proxy.id)
+                continue
+
+            blocked = page[0] in BLOCK_STATUSES
+            await proxy_pool.record(proxy, not blocked, time.monotonic() - started,
+                                    f"HTTP {page[0]}" if blocked else None)
+            if blocked and retry:
+                tried.append(proxy.id)
+                continue
+            return page
+
+
+def _entry_hash(site_id: int, url: str, title: str) -> str:
+    return hashlib.sha1(f"{site_id}|{canonical_url(url)}|{title.lower()}".encode("utf-8")).hexdigest()
+
+
+def _analyze_page(body: bytes, charset, base_url: str):
+    """
+    Разбор страницы (в потоке, одним проходом): фрагмент вокруг первой акции и отдельные карточки акций.
+    Если карточек не нашлось, а признак распродажи есть — одна «карточка» на саму страницу.
+    """
+    promo_text, entries = scan_page(body, charset, base_url)
+    if promo_text is None:
+        return None, []
+    if not entries:
+        discount = DISCOUNT_RE.search(promo_text)
+        entries = [{"title": promo_text, "url": base_url, "image": None,
+                    "discount": discount.group(0) if discount else None}]
+    return promo_text, entries
+
+
+def _promo_row(item, entry: dict, entry_hash: str) -> dict:
+    # Текст карточки со страницы магазина — экранируем, акции выводятся с parse_mode=HTML
+    title = entry["title"] if len(entry["title"]) <= PROMO_TITLE_CHARS else entry["title"][:PROMO_TITLE_CHARS] + "…"
+    return {
+        "site": item.name,
+        "site_id": item.id,
+        "title": html.escape(f"🔥 {item.name}: {title}"),
+        "url": entry["url"],   # ссылка как на странице магазина; каноническая — только в entry_hash
+        "image_url": entry["image"],
+        "discount": entry["discount"],
+        "entry_hash": entry_hash,
+    }
+
+
+async def _scan_site(item, sem, host_slots, prev, stats, states):
+    # Сначала очередь к своему хосту, потом общий лимит: пока сайт ждёт соседа по хосту, он не держит
+    # ни общий слот, ни прокси, и его SCAN_TIMEOUT ещё не идёт
+    async with host_slots[urlsplit(item.url).hostname or item.url], sem:
+        return await _scan_site_now(item, prev, stats, states)
+
+
+async def _scan_site_now(item, prev, stats, states):
+    """
+    Проверка одного сайта. prev — PromoScanState прошлого скана (или None).
+    Со страницы берутся отдельные карточки акций; их хеши сравниваются со снимком прошлого разбора,
+    и возвращаются только новые карточки (список строк для Promotion).
+    Если сервер ответил 304 или тело страницы не изменилось (тот же sha256), HTML не разбираем —
+    новых карточек нет. Новое состояние сайта добавляется в states.
+    Для планировщика «страница изменилась» — это другой набор карточек или другой текст акции,
+    а не другой sha256: в теле многих страниц меняются nonce и токены при каждом запросе.
+    """
+    started = time.monotonic()
+    # Валидаторы годятся, только если адрес сайта с прошлого скана не меняли
+    if prev is not None and prev.url != item.url:
+        prev = None
+    # Снимка карточек ещё нет (сайт не разбирался с этой версии) — страницу нужно разобрать целиком
+    snapshot = set(json.loads(prev.entry_hashes)) if prev is not None and prev.entry_hashes is not None else None
+    cached = prev if snapshot is not None else None
+    now = datetime.now()
+    try:
+        status, page, etag, last_modified = await _fetch_via_pool(
+            item.url, cached and cached.etag, cached and cached.last_modified
+        )
+        print(f"📡 Сайт: {item.name:15} | Статус: {status} | {time.monotonic() - started:.1f} c")
+
+        if status == 304 and cached is not None:
+            stats["not_modified"] += 1
+            states.append(_state_row(item, prev, now, "same", last_status=status,
+                                     etag=etag or prev.etag, last_modified=last_modified or prev.last_modified))
+            return []
+
+        if status == 403:
+            print(f"🚫 {item.name}: Доступ заблокирован (нужен другой прокси — добавьте в пул).")
+        if page is None:
+            stats["errors"] += 1
+            states.append(_state_row(item, prev, now, "error", last_status=status))
+            return []
+
+        body, charset = page
+        stats["downloaded"] += 1
+        stats["bytes"] += len(body)
+        body_hash = hashlib.sha256(body).hexdigest()
+        if cached is not None and cached.body_hash == body_hash:
+            stats["unchanged"] += 1
+            states.append(_state_row(item, prev, now, "same", last_status=status,
+                                     etag=etag, last_modified=last_modified))
+            return []
+
+        # Разбор HTML — в отдельном потоке, чтобы большие страницы не тормозили бота
+        stats["parsed"] += 1
+        promo_text, entries = await asyncio.to_thread(_analyze_page, body, charset, item.url)
+        hashes = [_entry_hash(item.id, e["url"], e["title"]) for e in entries]
+        new_rows = [_promo_row(item, e, h) for e, h in zip(entries, hashes) if h not in (snapshot or ())]
+        changed = snapshot is None or set(hashes) != snapshot or promo_text != prev.promo_text
+        states.append(_state_row(item, prev, now, "changed" if changed else "same", last_status=status, etag=etag,
+                                 last_modified=last_modified, body_hash=body_hash,
+                                 has_promo=promo_text is not None, promo_text=promo_text,
+                                 changed_at=now if changed else prev.changed_at, entry_hashes=json.dumps(hashes)))
+        stats["entries"] += len(entries)
+        if new_rows:
+            print(f"✅ НАЙДЕНО: {item.name} — новых акций {len(new_rows)} из {len(entries)}")
+        return new_rows
+    except asyncio.TimeoutError:
+        stats["errors"] += 1
+        states.append(_state_row(item, prev, now, "error", last_status=None))
+        print(f"❌ Ошибка {item.name}: таймаут {SCAN_TIMEOUT} c")
+    except Exception as e:
+        stats["errors"] += 1
+        states.append(_state_row(item, prev, now, "error", last_status=None))
+        print(f"❌ Ошибка {item.name}: {str(e)[:50]}...")
+    return []
+
+
+async def run_promo_scanner(site_ids=None):
+    """
+    Сканер акций: проверяет активные сайты из таблицы SiteSetting (все или только site_ids — так зовёт планировщик).
+    Запросы идут через пул прокси (parser/proxies.py), если он включён в админке.
+    Сайты проверяются параллельно (общий пул соединений, не больше SCAN_PER_HOST запросов на хост),
+    поэтому скан длится примерно как самый медленный сайт, а не как сумма всех, и не блокирует бота.
+    Запросы условные (ETag / Last-Modified), а неизменившиеся страницы не разбираются повторно —
+    сколько сайтов так пропущено, видно в last_scan_stats.
+    Возвращает только новые карточки акций (которых не было в прошлом снимке страницы) — для save_promotions.
+    """
+    async with _scan_lock:
+        return await _run_promo_scanner(site_ids)
+
+
+async def _run_promo_scanner(site_ids):
+    active_items = await _load_active_sites(site_ids)
+
+    if not active_items:
+        print("🔎 [SCANNER] Нет активных сайтов с URL для сканирования.")
+        return []
+
+    print(f"🚀 [SCANNER] Запуск проверки {len(active_items)} сайтов...")
+    started = time.monotonic()
+
+    # 3. ПАРАЛЛЕЛЬНЫЙ ОБХОД САЙТОВ
+    prev_states = await _load_scan_states([item.id for item in active_items])
+    stats = dict(sites=len(active_items), downloaded=0, bytes=0, not_modified=0, unchanged=0, parsed=0, errors=0,
+                 entries=0)
+    states = []
+    sem = asyncio.Semaphore(SCAN_CONCURRENCY)
+    host_slots = defaultdict(lambda: asyncio.Semaphore(SCAN_PER_HOST))
+    results = await asyncio.gather(*(
+        _scan_site(item, sem, host_slots, prev_states.get(item.id), stats, states) for item in active_items
+    ))
+    found_promos = [row for rows in results for row in rows]
+    await _save_scan_states(states)
+
+    stats["skipped"] = stats["not_modified"] + stats["unchanged"]
+    stats["found"] = len(found_promos)
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    last_scan_stats.clear()
+    last_scan_stats.update(stats)
+    print(f"🏁 [SCANNER] Проверено {len(active_items)} сайтов за {stats['seconds']} c, "
+          f"новых акций: {len(found_promos)} (карточек на разобранных страницах: {stats['entries']}), "
+          f"без изменений: {stats['skipped']} "
+          f"(304: {stats['not_modified']}, тот же хеш: {stats['unchanged']}), "
+          f"скачано {stats['bytes'] // 1024} КБ")
+    return found_promos
+
+
+async def save_promotions(found_items: list) -> int:
+    """
+    Новые карточки акций — одним пакетным INSERT в Promotion. Дубли отсекает уникальный индекс
+    по entry_hash (ON CONFLICT DO NOTHING). Возвращает число реально добавленных.
+    """
+    if not found_items:
+        return 0
+    rows = [
+        dict(site_name=item["site"], site_id=item["site_id"], title=item["title"], url=item["url"],
+             image_url=item["image_url"], discount=item["discount"], entry_hash=item["entry_hash"], is_active=True)
+        for item in found_items
+    ]
+    async with async_session() as session:
+        stmt = insert(Promotion).values(rows).on_conflict_do_nothing(index_elements=['entry_hash'])
+        result = await session.execute(stmt)
+        await session.commit()
+    return max(result.rowcount, 0)
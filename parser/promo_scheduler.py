@@ -0,0 +1,68 @@
+import asyncio
+import os
+import random
+
+from parser.promo_scanner import due_site_ids, run_promo_scanner, save_promotions
+
+# --- НАСТРОЙКИ (можно переопределить через .env) ---
+SCHEDULER_ENABLED = os.getenv("PROMO_SCHEDULER", "1") != "0"
+SCHEDULER_TICK = int(os.getenv("PROMO_SCHEDULER_TICK", 60))      # сек между проверками «кому пора»
+SCHEDULER_BATCH = int(os.getenv("PROMO_SCHEDULER_BATCH", 10))    # сайтов за один заход (новые сайты не идут пачкой)
+STARTUP_DELAY = 30                                                # сек после старта бота до первого захода
+
+
+class PromoScheduler:
+    """
+    Фоновый сканер акций: раз в SCHEDULER_TICK сек берёт сайты, у которых наступил next_run_at,
+    и проверяет их. Период каждого сайта подстраивает сам сканер (см. _schedule в promo_scanner),
+    а время следующей проверки хранится в promo_scan_states — после перезапуска бота всё не сканируется заново.
+    """
+
+    def __init__(self):
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not SCHEDULER_ENABLED or self.running:
+            return
+        self._task = asyncio.create_task(self._loop())
+        print(f"⏰ [SCANNER] Планировщик акций запущен: проверка каждые {SCHEDULER_TICK} c, "
+              f"до {SCHEDULER_BATCH} сайтов за раз")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def run_due(self) -> int:
+        """Один заход: проверяет сайты, которым пора. Возвращает число новых акций."""
+        site_ids = await due_site_ids(SCHEDULER_BATCH)
+        if not site_ids:
+            return 0
+        found = await run_promo_scanner(site_ids)
+        new_added = await save_promotions(found)
+        if new_added:
+            print(f"🆕 [SCANNER] Планировщик добавил новых акций: {new_added}")
+        return new_added
+
+    async def _loop(self):
+        # Небольшая случайная задержка: бот успевает подняться, а несколько копий не стартуют разом
+        await asyncio.sleep(STARTUP_DELAY + random.uniform(0, SCHEDULER_TICK))
+        while True:
+            try:
+                await self.run_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ [SCANNER] Ошибка планировщика: {e}")
+            await asyncio.sleep(SCHEDULER_TICK)
+
+
+promo_scheduler = PromoScheduler()
@@ -0,0 +1,212 @@
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+# Блоки, текст которых посетитель не видит (в скриптах «SALE» и «%» встречаются почти всегда).
+# <head> целиком не пропускаем: </head> в HTML5 необязателен, и без него «невидимой» стала бы вся страница
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "title"}
+BLOCK_TAGS = {"p", "div", "li", "br", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "td", "section",
+              "article", "header", "footer", "nav", "button", "option"}
+TITLE_CHARS = 90        # сколько текста вокруг совпадения уходит в заголовок акции
+# Карточки акций/товаров на странице: блоки, внутри которых ищем ссылку, картинку и признак скидки
+ENTRY_TAGS = {"li", "article", "div", "section", "figure", "td", "a"}
+ENTRY_MAX_CHARS = 300   # длиннее — это уже не карточка, а целый раздел страницы
+MAX_ENTRIES = 20        # карточек с одной страницы
+LIST_TAGS = {"ul", "ol", "table", "tr"}  # не карточки, но их закрытие закрывает незакрытые <li>/<td>
+# Меню, шапка и подвал сайта: ссылки «Sale», «Outlet», «Terms of Sale» есть почти на каждой странице — это не акции.
+# <header>/<footer> внутри <article>/<section> — заголовок карточки, его не пропускаем
+CHROME_TAGS = {"nav", "header", "footer"}
+SECTIONING_TAGS = {"article", "section"}
+
+# Признаки распродажи: слова целиком (\b), а «%» — только как скидка («-30%», «30% off», «до 50%»)
+PROMO_PATTERNS = [
+    r"(?<!\d)\d{1,2}\s?%\s?(?:off|discount|скидк\w*)",
+    r"(?:up\s+to|save|extra|до)\s+-?\d{1,2}\s?%",
+    r"-\s?\d{1,2}\s?%",
+    r"[$€£]\s?\d+(?:[.,]\d+)?\s+off\b",
+    r"\b(?:sale|clearance|discounts?|markdowns?|outlet)\b",
+    r"\b(?:акци[яийю]|скидк[аиуе]|распродаж[аиеу])\b",
+]
+PROMO_RE = re.compile("|".join(f"(?:{p})" for p in PROMO_PATTERNS), re.IGNORECASE)
+# Размер скидки для карточки: «-30%», «30% off», «$20 off», «до 50%»
+DISCOUNT_RE = re.compile(
+    r"(?<!\d)-?\s?\d{1,2}\s?%|[$€£]\s?\d+(?:[.,]\d+)?\s+off\b", re.IGNORECASE
+)
+# Цена рядом со ссылкой («$99», «1 299 грн», «49,90 €») — вместе с признаком распродажи делает блок карточкой
+PRICE_RE = re.compile(r"[$€£₴]\s?\d|\d\s?(?:[$€£₴]|грн|uah\b|usd\b|eur\b)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+class _PageExtractor(HTMLParser):
+    """
+    Один потоковый проход по странице, без дерева DOM: видимый текст (блоки разделены переводом строки,
+    содержимое script/style отбрасывается сразу) и карточки акций. Для каждого блока из ENTRY_TAGS
+    запоминаем его текст, первую ссылку и первую картинку; карточка — самый глубокий блок со ссылкой
+    вне меню/шапки/подвала, в тексте которого есть признак распродажи и размер скидки или цена
+    (одного слова «Sale» мало — так подписан раздел в меню).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []      # весь видимый текст; блок помнит, с какого куска начинается
+        self.stack = []      # открытые блоки: [тег, начало текста, ссылка, картинка, есть ли карточка внутри, в меню]
+        self.entries = []
+        self._skip = 0
+        self._chrome = 0     # глубина вложенности в меню/шапку/подвал
+        self._chrome_open = []  # для каждого открытого CHROME_TAGS: учтён ли он в _chrome
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            self._skip = 0
+        if tag in SKIP_TAGS:
+            self._skip += 1
+            return
+        if self._skip:
+            return
+        attrs = dict(attrs)
+        self.parts.append("\n" if tag in BLOCK_TAGS else " ")
+        if tag in ("li", "td"):
+            # <li> без </li>: новый пункт списка закрывает предыдущий
+            self._close_implicit(tag)
+        if tag in CHROME_TAGS:
+            counted = tag == "nav" or not any(frame[0] in SECTIONING_TAGS for frame in self.stack)
+            self._chrome_open.append(counted)
+            self._chrome += counted
+        if tag in ENTRY_TAGS or tag in LIST_TAGS:
+            self.stack.append([tag, len(self.parts), None, None, False, self._chrome > 0])
+        if tag == "a" and attrs.get("href") and not attrs["href"].startswith(("#", "javascript:", "mailto:", "tel:")):
+            for frame in self.stack:
+                frame[2] = frame[2] or attrs["href"]
+        elif tag == "img":
+            src = attrs.get("src") or attrs.get("data-src")
+            if src and not src.startswith("data:"):
+                for frame in self.stack:
+                    frame[3] = frame[3] or src
+            # Текст баннера часто только в alt картинки («SALE -50%»)
+            if attrs.get("alt") and not self._chrome:
+                self.parts.append(f" {attrs['alt']} ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            if self._skip:
+                self._skip -= 1
+            return
+        if self._skip:
+            return
+        self.parts.append("\n" if tag in BLOCK_TAGS else " ")
+        if tag in CHROME_TAGS and self._chrome_open:
+            self._chrome -= self._chrome_open.pop()
+        if not any(frame[0] == tag for frame in self.stack):
+            return
+        # Незакрытые вложенные теги закрываем вместе с родителем
+        while self.stack:
+            frame = self.stack.pop()
+            self._close(frame)
+            if frame[0] == tag:
+                break
+
+    def handle_data(self, data):
+        # Текст меню/шапки/подвала в текст страницы не идёт: «Sale» в меню есть почти у каждого магазина
+        if not self._skip and not self._chrome:
+            # Переводы строк внутри текста — не граница блока
+            self.parts.append(data.replace("\n", " "))
+
+    def _close_implicit(self, tag):
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] in LIST_TAGS:
+                return
+            if self.stack[i][0] == tag:
+                while len(self.stack) > i:
+                    self._close(self.stack.pop())
+                return
+
+    def _close(self, frame):
+        tag, start, link, image, has_entry, in_chrome = frame
+        if tag in ENTRY_TAGS and not has_entry and not in_chrome and link and len(self.entries) < MAX_ENTRIES:
+            text = _SPACES.sub(" ", "".join(self.parts[start:])).strip()
+            if 3 <= len(text) <= ENTRY_MAX_CHARS and PROMO_RE.search(text):
+                discount = DISCOUNT_RE.search(text)
+                if discount or PRICE_RE.search(text):
+                    self.entries.append({
+                        "title": text,
+                        "link": link,
+                        "image": image,
+                        "discount": _SPACES.sub(" ", discount.group(0)).strip() if discount else None,
+                    })
+                    has_entry = True
+        if has_entry and self.stack:
+            # Родитель карточки сам карточкой уже не считается
+            self.stack[-1][4] = True
+
+    def close(self):
+        super().close()
+        while self.stack:
+            self._close(self.stack.pop())
+
+
+def _promo_match(text: str):
+    """
+    Первое совпадение PROMO_RE, рядом с которым (в том же блоке, не дальше TITLE_CHARS) есть размер скидки
+    или цена: одно слово «Sale» без цифр — скорее заголовок раздела, чем распродажа.
+    """
+    for match in PROMO_RE.finditer(text):
+        start = max(text.rfind("\n", 0, match.start()) + 1, match.start() - TITLE_CHARS)
+        line_end = text.find("\n", match.end())
+        end = min(line_end if line_end != -1 else len(text), match.end() + TITLE_CHARS)
+        if DISCOUNT_RE.search(text, start, end) or PRICE_RE.search(text, start, end):
+            return match
+    return None
+
+
+def scan_page(body: bytes, charset=None, base_url: str = "", chunk_size: int = 64 * 1024) -> tuple:
+    """
+    Разбор страницы за один проход: (фрагмент текста вокруг первого признака распродажи или None, карточки).
+    Карточки — [{"title", "url", "image", "discount"}], не больше MAX_ENTRIES, без повторов по ссылке
+    и тексту; ссылки и картинки абсолютные.
+    """
+    html_text = body.decode(charset or "utf-8", errors="replace")
+    extractor = _PageExtractor()
+    for i in range(0, len(html_text), chunk_size):
+        extractor.feed(html_text[i:i + chunk_size])
+    extractor.close()
+
+    # Пробелы не нормализуются (PROMO_RE их понимает) — только во фрагменте для заголовка, так быстрее
+    text = "".join(extractor.parts)
+    match = _promo_match(text)
+    snippet = promo_snippet(text, match.start(), match.end()) if match else None
+
+    entries, seen = [], set()
+    for entry in extractor.entries:
+        url = urljoin(base_url, entry["link"])
+        key = (url, entry["title"].lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        entries.append({
+            "title": entry["title"],
+            "url": url,
+            "image": urljoin(base_url, entry["image"]) if entry["image"] else None,
+            "discount": entry["discount"],
+        })
+    return snippet, entries
+
+
+def promo_snippet(text: str, start: int, end: int, limit: int = TITLE_CHARS) -> str:
+    """Строка страницы вокруг совпадения (обрезанная до limit символов) — для заголовка акции."""
+    line_start = text.rfind("\n", 0, start) + 1
+    line_end = text.find("\n", end)
+    line = text[line_start:line_end if line_end != -1 else len(text)]
+    # Схлопываем пробелы, пересчитывая позицию совпадения в новой строке
+    offset = len(_SPACES.sub(" ", text[line_start:start]).lstrip())
+    width = len(_SPACES.sub(" ", text[start:end]))
+    line = _SPACES.sub(" ", line).strip()
+    if len(line) <= limit:
+        return line
+    # Длинная строка: окно вокруг совпадения по границам слов
+    left = max(0, offset - (limit - width) // 2)
+    snippet = line[left:left + limit]
+    if left > 0:
+        snippet = "…" + snippet.split(" ", 1)[-1]
+    if left + limit < len(line):
+        snippet = snippet.rsplit(" ", 1)[0] + "…"
+    return snippet
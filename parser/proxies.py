@@ -0,0 +1,291 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.sqlite import insert
+
+from database.db_setup import async_session
+from database.models import GlobalSetting, ProxyEndpoint
+
+# --- НАСТРОЙКИ (можно переопределить через .env) ---
+PROXY_MAX_CONCURRENCY = int(os.getenv("PROXY_MAX_CONCURRENCY", 4))   # одновременных запросов через один прокси
+PROXY_WAIT = int(os.getenv("PROXY_WAIT", 10))                         # сек ждём свободный прокси, потом идём напрямую
+QUARANTINE_FAILURES = 3                                               # неудач подряд до карантина
+QUARANTINE_BASE = 300                                                 # сек первого карантина, дальше вдвое дольше
+QUARANTINE_MAX = 6 * 3600
+RELOAD_EVERY = 60                                                     # сек: подхватываем правки из админки
+EWMA_ALPHA = 0.2                                                      # вес нового замера в скользящих оценках
+DEFAULT_LATENCY_MS = 1000.0                                           # у нового прокси — пока не замерили
+
+# Ответы, после которых виноват скорее прокси (его заблокировали или он сам отказал), чем сайт
+BLOCK_STATUSES = {403, 407, 429}
+# Ошибки сети/прокси в тексте ошибки парсера (aiohttp и Playwright); «цена не найдена» прокси не в минус
+NETWORK_ERROR_MARKERS = ("net::ERR_", "Timeout", "timeout", "Cannot connect", "ProxyError", "407", "Connection reset")
+
+
+def is_proxy_failure(error) -> bool:
+    return bool(error) and any(marker in error for marker in NETWORK_ERROR_MARKERS)
+
+
+def playwright_proxy(url: str):
+    """Адрес прокси в виде, который понимает Playwright: {"server", "username", "password"}."""
+    if not url:
+        return None
+    parts = urlsplit(url)
+    server = f"{parts.scheme or 'http'}://{parts.hostname}" + (f":{parts.port}" if parts.port else "")
+    proxy = {"server": server}
+    if parts.username:
+        proxy["username"] = parts.username
+        proxy["password"] = parts.password or ""
+    return proxy
+
+
+class _Proxy:
+    def __init__(self, row: ProxyEndpoint):
+        self.id = row.id
+        self.url = row.url
+        self.active = 0
+        self.streak = 0   # неудач подряд
+        self.update_from(row)
+
+    def update_from(self, row: ProxyEndpoint):
+        self.url = row.url
+        self.latency_ms = row.latency_ms
+        self.success_rate = row.success_rate if row.success_rate is not None else 1.0
+        self.requests = row.requests or 0
+        self.failures = row.failures or 0
+        self.quarantines = row.quarantines or 0
+        self.quarantined_until = row.quarantined_until
+        self.last_error = row.last_error
+
+    @property
+    def host(self) -> str:
+        return urlsplit(self.url).hostname or self.url
+
+    def quarantined(self, now: datetime) -> bool:
+        return self.quarantined_until is not None and self.quarantined_until > now
+
+    @property
+    def score(self) -> float:
+        """Чем выше, тем лучше: успешность важнее скорости, занятые прокси проигрывают свободным."""
+        latency = self.latency_ms or DEFAULT_LATENCY_MS
+        return self.success_rate ** 2 / (latency + 300) / (1 + self.active)
+
+
+class ProxyPool:
+    """
+    Пул прокси для сканера акций и парсера (HTTP и браузер):
+    - каждый запрос получает лучший здоровый прокси (успешность и скорость — скользящие средние);
+    - не больше PROXY_MAX_CONCURRENCY запросов через один прокси одновременно;
+    - после QUARANTINE_FAILURES неудач подряд прокси уходит в карантин (каждый следующий — вдвое дольше),
+      после карантина одна неудача сразу возвращает его обратно.
+    Общий выключатель — прежний флаг proxy_enabled в GlobalSetting. Пул живёт в процессе бота:
+    воркеры парсера получают уже выбранный адрес вместе с заданием.
+    """
+
+    def __init__(self):
+        self._proxies = {}        # id -> _Proxy
+        self._enabled = False
+        self._loaded_at = 0.0
+        self._load_lock = asyncio.Lock()
+        self._cond = asyncio.Condition()
+
+    async def _refresh(self, force: bool = False):
+        if not force and time.monotonic() - self._loaded_at < RELOAD_EVERY:
+            return
+        async with self._load_lock:
+            if not force and time.monotonic() - self._loaded_at < RELOAD_EVERY:
+                return
+            try:
+                await self._load()
+            except Exception as e:
+                print(f"⚠️ [PROXY] Не удалось загрузить пул прокси: {e}")
+            self._loaded_at = time.monotonic()
+
+    async def _load(self):
+        async with async_session() as session:
+            res = await session.execute(select(GlobalSetting).where(GlobalSetting.key.in_(["proxy_enabled", "proxy_url"])))
+            settings = {s.key: s for s in res.scalars().all()}
+            self._enabled = bool(settings.get("proxy_enabled") and settings["proxy_enabled"].value == 1.0)
+
+            # Раньше прокси был один (GlobalSetting.proxy_url) — переносим его в пул
+            count = (await session.execute(select(func.count(ProxyEndpoint.id)))).scalar() or 0
+            legacy = settings.get("proxy_url")
+            if count == 0 and legacy and legacy.value_str and "http" in legacy.value_str:
+                await session.execute(insert(ProxyEndpoint).values(url=legacy.value_str).on_conflict_do_nothing())
+                await session.commit()
+
+            res = await session.execute(select(ProxyEndpoint).where(ProxyEndpoint.is_active.in_([True, 1])))
+            rows = res.scalars().all()
+
+        proxies = {}
+        for row in rows:
+            proxy = self._proxies.get(row.id)
+            if proxy is None:
+                proxy = _Proxy(row)
+            else:
+                proxy.update_from(row)
+            proxies[row.id] = proxy
+        self._proxies = proxies
+
+    def reload(self):
+        self._loaded_at = 0.0
+
+    def _pick(self, exclude, now: datetime):
+        candidates = [
+            p for p in self._proxies.values()
+            if p.id not in exclude and not p.quarantined(now) and p.active < PROXY_MAX_CONCURRENCY
+        ]
+        if not candidates:
+            return None
+        best = max(p.score for p in candidates)
+        # Среди почти равных — случайный, чтобы нагрузка не липла к одному прокси
+        return random.choice([p for p in candidates if p.score >= best * 0.9])
+
+    def _has_usable(self, exclude, now: datetime) -> bool:
+        return any(p.id not in exclude and not p.quarantined(now) for p in self._proxies.values())
+
+    async def acquire(self, exclude=()):
+        """Лучший свободный прокси (ждём не дольше PROXY_WAIT) или None. Вернуть — release(); проще — use()."""
+        await self._refresh()
+        if not self._enabled:
+            return None
+        deadline = time.monotonic() + PROXY_WAIT
+        async with self._cond:
+            while True:
+                now = datetime.now()
+                proxy = self._pick(exclude, now)
+                if proxy is not None:
+                    proxy.active += 1
+                    return proxy
+                remaining = deadline - time.monotonic()
+                if not self._has_usable(exclude, now) or remaining <= 0:
+                    if self._proxies:
+                        print("⚠️ [PROXY] Нет свободного здорового прокси — запрос идёт напрямую")
+                    return None
+                try:
+                    await asyncio.wait_for(self._cond.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, proxy: _Proxy):
+        async with self._cond:
+            proxy.active -= 1
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def use(self, exclude=()):
+        """
+        `async with proxy_pool.use() as proxy:` — proxy.url для запроса или None (пул выключен / пуст / всё занято).
+        После запроса вызовите `await proxy_pool.record(proxy, ok, latency)`.
+        exclude — id прокси, которые уже не сработали на этом запросе.
+        """
+        proxy = await self.acquire(exclude)
+        try:
+            yield proxy
+        finally:
+            if proxy is not None:
+                await self.release(proxy)
+
+    async def record(self, proxy, ok: bool, latency: float = None, error: str = None):
+        """Итог запроса через прокси: обновляет оценки и при необходимости отправляет в карантин."""
+        if proxy is None:
+            return
+        now = datetime.now()
+        proxy.requests += 1
+        proxy.success_rate = (1 - EWMA_ALPHA) * proxy.success_rate + EWMA_ALPHA * (1.0 if ok else 0.0)
+        if ok and latency is not None:
+            ms = latency * 1000
+            proxy.latency_ms = ms if proxy.latency_ms is None else (1 - EWMA_ALPHA) * proxy.latency_ms + EWMA_ALPHA * ms
+
+        if ok:
+            proxy.streak, proxy.quarantines = 0, 0
+        else:
+            proxy.failures += 1
+            proxy.streak += 1
+            proxy.last_error = (error or "ошибка")[:200]
+            # Только что вышедшему из карантина хватает одной неудачи
+            if not proxy.quarantined(now) and (proxy.streak >= QUARANTINE_FAILURES or proxy.quarantines):
+                seconds = min(QUARANTINE_MAX, QUARANTINE_BASE * 2 ** proxy.quarantines)
+                proxy.quarantined_until = now + timedelta(seconds=seconds)
+                proxy.quarantines += 1
+                proxy.streak = 0
+                print(f"🚧 [PROXY] {proxy.host} в карантине на {seconds // 60} мин: {proxy.last_error}")
+
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    update(ProxyEndpoint).where(ProxyEndpoint.id == proxy.id).values(
+                        latency_ms=proxy.latency_ms, success_rate=proxy.success_rate,
+                        requests=proxy.requests, failures=proxy.failures, quarantines=proxy.quarantines,
+                        quarantined_until=proxy.quarantined_until, last_error=proxy.last_error, last_used_at=now,
+                    )
+                )
+                await session.commit()
+        except Exception as e:
+            print(f"⚠️ [PROXY] Не удалось сохранить оценку прокси: {e}")
+
+    async def record_result(self, proxy, result: dict, latency: float = None):
+        """
+        Итог парсинга товара через прокси: страница открылась (пусть и без цены) — прокси отработал;
+        ошибка сети/таймаут или ответ 403/429 (прокси заблокирован магазином) — его минус, как и в сканере акций.
+        Наши внутренние сбои (флаг "internal": свой таймаут задачи, перезапуск воркера) прокси не оцениваем.
+        """
+        if result.get("internal"):
+            return
+        error = result.get("error")
+        status = result.get("http_status")
+        ok = not is_proxy_failure(error) and status not in BLOCK_STATUSES
+        await self.record(proxy, ok, latency, error or (f"HTTP {status}" if not ok else None))
+
+    async def add(self, urls: list) -> int:
+        """Добавляет прокси в пул (уже известные — просто включает и снимает с карантина)."""
+        added = 0
+        async with async_session() as session:
+            for url in urls:
+                stmt = insert(ProxyEndpoint).values(url=url, is_active=True)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['url'], set_=dict(is_active=True, quarantined_until=None, quarantines=0)
+                )
+                await session.execute(stmt)
+                added += 1
+            await session.commit()
+        await self._refresh(force=True)
+        return added
+
+    async def remove(self, proxy_id: int):
+        async with async_session() as session:
+            await session.execute(delete(ProxyEndpoint).where(ProxyEndpoint.id == proxy_id))
+            await session.commit()
+        await self._refresh(force=True)
+
+    async def report(self) -> list:
+        """Прокси для админки: лучшие первыми."""
+        await self._refresh(force=True)
+        now = datetime.now()
+        rows = []
+        for p in sorted(self._proxies.values(), key=lambda p: (p.quarantined(now), -p.score)):
+            rows.append({
+                "id": p.id,
+                "host": p.host,
+                "latency_ms": round(p.latency_ms) if p.latency_ms is not None else None,
+                "success_rate": round(p.success_rate, 2),
+                "requests": p.requests,
+                "active": p.active,
+                "quarantined_min": max(0, round((p.quarantined_until - now).total_seconds() / 60))
+                if p.quarantined(now) else 0,
+                "last_error": p.last_error,
+            })
+        return rows
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+
+proxy_pool = ProxyPool()
@@ -0,0 +1,72 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from database.db_setup import async_session
+from database.models import PriceSourceStat
+from parser.extractors import PRICE_SOURCES
+
+
+class PriceSourceStats:
+    """
+    Статистика, откуда на каждом домене реально берётся цена: какой CSS-селектор, JSON-LD или og-теги.
+    По ней порядок перебора подстраивается под магазин: «победитель» идёт первым.
+    Хранится в таблице price_source_stats, поэтому выученный порядок переживает перезапуск бота.
+    """
+
+    def __init__(self):
+        self._hits = None   # домен -> {источник: попаданий}
+        self._lock = asyncio.Lock()
+
+    async def _load(self):
+        hits = defaultdict(dict)
+        try:
+            async with async_session() as session:
+                res = await session.execute(select(PriceSourceStat))
+                for row in res.scalars().all():
+                    hits[row.domain][row.source] = row.hits or 0
+        except Exception as e:
+            print(f"⚠️ [PARSER] Не удалось загрузить статистику источников цены: {e}")
+        self._hits = hits
+
+    async def _ensure_loaded(self):
+        if self._hits is None:
+            async with self._lock:
+                if self._hits is None:
+                    await self._load()
+
+    async def order(self, domain: str, selectors: list):
+        """Селекторы цены и порядок источников (css / jsonld / og) для домена — самые удачные первыми."""
+        await self._ensure_loaded()
+        hits = self._hits.get(domain)
+        if not hits:
+            return list(selectors), list(PRICE_SOURCES)
+
+        # sorted стабилен: при равенстве сохраняется исходный порядок (селекторы магазина / общий каскад)
+        ordered = sorted(selectors, key=lambda s: -hits.get(f"css:{s}", 0))
+        kind_hits = {"css": sum(v for k, v in hits.items() if k.startswith("css:")),
+                     "jsonld": hits.get("jsonld", 0), "og": hits.get("og", 0)}
+        sources = sorted(PRICE_SOURCES, key=lambda k: -kind_hits[k])
+        return ordered, sources
+
+    async def record(self, domain: str, source: str):
+        await self._ensure_loaded()
+        domain_hits = self._hits.setdefault(domain, {})
+        domain_hits[source] = domain_hits.get(source, 0) + 1
+        try:
+            async with async_session() as session:
+                stmt = insert(PriceSourceStat).values(domain=domain, source=source, hits=1, last_hit_at=datetime.now())
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['domain', 'source'],
+                    set_=dict(hits=PriceSourceStat.hits + 1, last_hit_at=datetime.now())
+                )
+                await session.execute(stmt)
+                await session.commit()
+        except Exception as e:
+            print(f"⚠️ [PARSER] Не удалось сохранить статистику источников цены: {e}")
+
+
+price_source_stats = PriceSourceStats()
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+from parser import metrics
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Куда складывать cookies/localStorage магазинов (по файлу на домен)
+STATE_DIR = os.getenv("PARSER_STATE_DIR", os.path.join(PROJECT_ROOT, "browser_state"))
+STATE_REFRESH = 3600        # пересохранять состояние после удачного парсинга не чаще раза в час (сек)
+STATE_MAX_AGE = 24 * 3600   # более старое состояние не используем: куки согласия/антибота могли протухнуть
+FAIL_LIMIT = 2              # столько неудач подряд с сохранённым состоянием — и оно удаляется
+
+
+def _belongs(host: str, domain: str) -> bool:
+    host = host.lstrip(".").lower()
+    return host == domain or host.endswith("." + domain)
+
+
+class StorageStateStore:
+    """
+    Playwright storage_state (cookies + localStorage) по доменам магазинов, на диске.
+    Браузер приходит на сайт уже «своим»: баннер cookies принят, гео выбрано, антибот пройден.
+    Файлы общие для всех процессов-воркеров. Состояние пересохраняется после удачных парсингов
+    и удаляется, если с ним извлечение начинает падать.
+    """
+
+    def __init__(self, state_dir: str = STATE_DIR):
+        self.state_dir = state_dir
+        self._loaded = {}     # домен -> (mtime, state)
+        self._failures = {}   # домен -> неудач подряд
+
+    def _path(self, domain: str) -> str:
+        return os.path.join(self.state_dir, f"{domain}.json")
+
+    def _age(self, domain: str):
+        try:
+            return time.time() - os.path.getmtime(self._path(domain))
+        except OSError:
+            return None
+
+    def load(self, domain: str):
+        """Состояние для нового контекста или None (нет, протухло, битое)."""
+        path = self._path(domain)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - mtime > STATE_MAX_AGE:
+            return None
+
+        cached = self._loaded.get(domain)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._loaded[domain] = (mtime, state)
+        return state
+
+    def needs_refresh(self, domain: str) -> bool:
+        age = self._age(domain)
+        return age is None or age > STATE_REFRESH
+
+    def save(self, domain: str, state: dict):
+        """Сохраняет только то, что относится к магазину (контексты пула общие для разных доменов)."""
+        state = {
+            "cookies": [c for c in state.get("cookies", []) if _belongs(c.get("domain", ""), domain)],
+            "origins": [o for o in state.get("origins", [])
+                        if _belongs(urlsplit(o.get("origin", "")).hostname or "", domain)],
+        }
+        path = self._path(domain)
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ [PARSER] Не удалось сохранить состояние браузера для {domain}: {e}")
+            return
+        self._loaded.pop(domain, None)
+        metrics.incr("storage_state_saved", domain)
+
+    def invalidate(self, domain: str):
+        self._loaded.pop(domain, None)
+        self._failures.pop(domain, None)
+        try:
+            os.remove(self._path(domain))
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"⚠️ [PARSER] Не удалось удалить состояние браузера для {domain}: {e}")
+            return
+        metrics.incr("storage_state_invalidated", domain)
+        print(f"🍪 [PARSER] {domain}: сохранённые cookies сброшены после {FAIL_LIMIT} неудач подряд")
+
+    def record(self, domain: str, ok: bool, used_state: bool):
+        """Учёт исхода парсинга: серия неудач с сохранённым состоянием — повод его выбросить."""
+        if ok:
+            self._failures.pop(domain, None)
+            return
+        if not used_state:
+            return
+        self._failures[domain] = self._failures.get(domain, 0) + 1
+        if self._failures[domain] >= FAIL_LIMIT:
+            self.invalidate(domain)
+
+
+storage_states = StorageStateStore()
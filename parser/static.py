@@ -0,0 +1,89 @@
+import aiohttp
+from bs4 import BeautifulSoup
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+STATIC_TIMEOUT = 10          # секунд на весь HTTP-запрос
+MAX_HTML_BYTES = 3 * 1024 * 1024
+
+# Одна сессия с пулом соединений на весь процесс (keep-alive, кэш DNS)
+_session = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=STATIC_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=30, limit_per_host=4, ttl_dns_cache=300),
+        )
+    return _session
+
+
+async def close_http_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def fetch_html(url: str, proxy=None):
+    """Скачивает HTML страницы (не больше MAX_HTML_BYTES). Возвращает текст или None (не 200 / не HTML)."""
+    async with get_http_session().get(url, proxy=proxy, allow_redirects=True) as resp:
+        if resp.status != 200 or "html" not in resp.headers.get("Content-Type", "html"):
+            return None
+        body = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            body += chunk
+            if len(body) >= MAX_HTML_BYTES:
+                break
+        return body.decode(resp.charset or "utf-8", errors="replace")
+
+
+def _select_first(soup, selector):
+    try:
+        return soup.select_one(selector)
+    except Exception:
+        return None
+
+
+def collect_static(html: str, args: dict) -> dict:
+    """
+    Собирает кандидатов из серверного HTML в том же виде, что COLLECT_CANDIDATES_JS в браузере,
+    чтобы выбор цены/заголовка/картинки был одним и тем же кодом (extract_from_candidates).
+    """
+    soup = BeautifulSoup(html, "html.parser")
+
+    def text(el):
+        return el.get_text(" ", strip=True) or None if el else None
+
+    meta = {}
+    for key in args["meta"]:
+        tag = soup.find("meta", attrs={"property": key}) or soup.find("meta", attrs={"name": key})
+        if tag:
+            meta[key] = tag.get("content")
+
+    prices = []
+    for s in args["price"]:
+        el = _select_first(soup, s)
+        prices.append((text(el) or el.get("content")) if el else None)
+
+    images = []
+    for s in args["image"]:
+        el = _select_first(soup, s)
+        images.append((el.get("content") or el.get("src") or el.get("data-src")) if el else None)
+
+    return {
+        "title": soup.title.string if soup.title else None,
+        "meta": meta,
+        "name": [text(_select_first(soup, s)) for s in args["name"]],
+        "price": prices,
+        "image": images,
+        "jsonld": [script.string or script.get_text() for script in
+                   soup.find_all("script", attrs={"type": "application/ld+json"})],
+    }
@@ -0,0 +1,92 @@
+import os
+from collections import defaultdict
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert
+
+from database.db_setup import async_session
+from database.models import GlobalSetting
+from parser.normalize import is_usable_price
+
+# Гонка стратегий для незнакомых доменов (0 — по-старому: сначала HTTP, потом браузер)
+RACE_ENABLED = os.getenv("PARSER_RACE", "1") != "0"
+# Раз в столько запросов к домену снова устраиваем гонку: магазин мог сменить вёрстку
+RERACE_EVERY = 25
+
+STRATEGIES = ("http", "browser")
+
+
+class StrategyPlanner:
+    """
+    Какой путь парсинга выбрать для домена:
+    - "race"    — HTTP и браузер одновременно, берём первый результат с ценой (домен ещё не изучен);
+    - "http"    — сначала HTTP, браузер только если цены нет;
+    - "browser" — сразу браузер (HTTP для этого магазина бесполезен).
+    Победитель гонки запоминается в GlobalSetting: parser_strategy_<домен> = "http" / "browser".
+    """
+
+    def __init__(self):
+        self._preferred = None              # домен -> "http" / "browser"
+        self._requests = defaultdict(int)
+
+    async def _load(self):
+        self._preferred = {}
+        try:
+            async with async_session() as session:
+                res = await session.execute(
+                    select(GlobalSetting).where(GlobalSetting.key.startswith("parser_strategy_"))
+                )
+                for s in res.scalars().all():
+                    if s.value_str in STRATEGIES:
+                        self._preferred[s.key.removeprefix("parser_strategy_")] = s.value_str
+        except Exception as e:
+            print(f"⚠️ [PARSER] Не удалось прочитать стратегии доменов: {e}")
+
+    async def choose(self, domain: str) -> str:
+        if self._preferred is None:
+            await self._load()
+        preferred = self._preferred.get(domain)
+        if not RACE_ENABLED:
+            return preferred or "http"
+
+        self._requests[domain] += 1
+        if preferred and self._requests[domain] % RERACE_EVERY:
+            return preferred
+        return "race"
+
+    async def record(self, domain: str, mode: str, result: dict):
+        """Запоминает исход: победившая стратегия становится основной, провал — повод снова устроить гонку."""
+        winner = result.get("strategy") if "error" not in result and is_usable_price(result.get("price")) else None
+        current = self._preferred.get(domain) if self._preferred is not None else None
+
+        if winner and (mode == "race" or winner != mode):
+            if winner != current:
+                await self._save(domain, winner)
+        elif not winner and current and mode != "race":
+            await self._save(domain, None)
+
+    async def _save(self, domain: str, strategy):
+        if self._preferred is None:
+            await self._load()
+        key = f"parser_strategy_{domain}"
+        try:
+            async with async_session() as session:
+                if strategy:
+                    stmt = insert(GlobalSetting).values(key=key, value_str=strategy)
+                    stmt = stmt.on_conflict_do_update(index_elements=['key'], set_=dict(value_str=strategy))
+                    await session.execute(stmt)
+                else:
+                    await session.execute(delete(GlobalSetting).where(GlobalSetting.key == key))
+                await session.commit()
+        except Exception as e:
+            print(f"⚠️ [PARSER] Не удалось сохранить стратегию для {domain}: {e}")
+
+        if strategy:
+            self._preferred[domain] = strategy
+            print(f"🏁 [PARSER] {domain}: основная стратегия — {strategy}")
+        else:
+            self._preferred.pop(domain, None)
+            print(f"🏁 [PARSER] {domain}: стратегия сброшена, следующий запрос — гонка")
+
+
+strategy_planner = StrategyPlanner()
@@ -0,0 +1,96 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Рекламные/трекинговые параметры, которые не влияют на товар
+TRACKING_PARAMS = {
+    "gclid", "gbraid", "wbraid", "dclid", "fbclid", "msclkid", "yclid", "igshid", "ttclid", "twclid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "srsltid", "_hsenc", "_hsmi", "hsctatracking", "mkt_tok",
+    "irclickid", "irgwc", "ranmid", "raneaid", "ransiteid", "clickid", "affid", "aff_id",
+    "ref_", "ref_src", "refsrc", "spm", "scm", "si", "trk", "trkid", "sc_cid", "cmpid",
+    "_branch_match_id", "_branch_referrer", "epik", "s_kwcid", "ef_id", "cjevent", "awc", "sv1", "sv_campaign_id",
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_", "hsa_", "pf_rd_", "pd_rd_")
+
+# Поддомены, которые ведут на тот же товар (мобильная версия и т.п.)
+HOST_PREFIXES = ("www.", "m.", "mobile.", "www2.")
+
+# Правила магазинов: path — регулярка, первая группа которой и есть адрес товара;
+# keep — какие параметры оставить (None — все, кроме трекинговых; () — ни одного)
+DOMAIN_RULES = {
+    "amazon.com": {"path": r"/(?:[^/]+/)?(?:dp|gp/product|gp/aw/d)/([A-Z0-9]{10})", "format": "/dp/{}", "keep": ()},
+    "amazon.de": {"path": r"/(?:[^/]+/)?(?:dp|gp/product|gp/aw/d)/([A-Z0-9]{10})", "format": "/dp/{}", "keep": ()},
+    "amazon.co.uk": {"path": r"/(?:[^/]+/)?(?:dp|gp/product|gp/aw/d)/([A-Z0-9]{10})", "format": "/dp/{}", "keep": ()},
+    "ebay.com": {"path": r"/itm/(?:[^/]+/)?(\d+)", "format": "/itm/{}", "keep": ()},
+    "ebay.de": {"path": r"/itm/(?:[^/]+/)?(\d+)", "format": "/itm/{}", "keep": ()},
+    "etsy.com": {"path": r"/listing/(\d+)", "format": "/listing/{}", "keep": ()},
+    "aliexpress.com": {"path": r"/item/(\d+)\.html", "format": "/item/{}.html", "keep": ()},
+    "6pm.com": {"keep": ()},
+    "zappos.com": {"keep": ()},
+    "asos.com": {"keep": ("colourwayid",)},
+}
+
+_COMPILED = {domain: dict(rule, path=re.compile(rule["path"]) if "path" in rule else None)
+             for domain, rule in DOMAIN_RULES.items()}
+_JSESSION = re.compile(r";jsessionid=[^/?#]*", re.IGNORECASE)
+_SLASHES = re.compile(r"/{2,}")
+
+
+def normalize_host(host: str) -> str:
+    """Хост без порта по умолчанию, точки в конце и мобильных/www-префиксов."""
+    host = host.lower().rstrip(".")
+    for prefix in HOST_PREFIXES:
+        # m.shop.com -> shop.com, но не «m.com» -> «com»
+        if host.startswith(prefix) and host.count(".") > 1:
+            return host[len(prefix):]
+    return host
+
+
+def _rule_for(host: str):
+    while host:
+        rule = _COMPILED.get(host)
+        if rule:
+            return rule
+        if "." not in host:
+            return None
+        host = host.split(".", 1)[1]
+    return None
+
+
+def _is_tracking(key: str) -> bool:
+    key = key.lower()
+    return key in TRACKING_PARAMS or key.startswith(TRACKING_PREFIXES)
+
+
+@lru_cache(maxsize=8192)
+def canonical_url(url: str) -> str:
+    """
+    Канонический вид ссылки на товар — только ключ (кеш, индекс товаров, хеш карточки акции):
+    без трекинговых параметров и якоря, хост без www./m., параметры отсортированы, без завершающего '/',
+    плюс правила магазина из DOMAIN_RULES (например, у Amazon остаётся только /dp/<ASIN>).
+    В корзину, заказ и Promotion.url сохраняется исходная ссылка — по ней магазин точно откроется.
+    """
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or "https").lower()
+    host = normalize_host(parts.hostname or "")
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if (scheme, port) in (("http", 80), ("https", 443)):
+        port = None
+    netloc = f"{host}:{port}" if port else host
+
+    path = _SLASHES.sub("/", _JSESSION.sub("", parts.path)).rstrip("/") or "/"
+    rule = _rule_for(host)
+    if rule and rule["path"]:
+        match = rule["path"].search(path)
+        if match:
+            path = rule["format"].format(match.group(1))
+
+    keep = rule.get("keep") if rule else None
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking(k) and (keep is None or k.lower() in keep)
+    ]
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), ""))
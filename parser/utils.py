@@ -0,0 +1,7 @@
+from urllib.parse import urlparse
+
+
+def get_domain(url: str) -> str:
+    """Домен магазина без 'www.' — ключ для всех per-domain настроек парсера."""
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
@@ -0,0 +1,59 @@
+import time
+
+from parser import metrics
+
+# Границы ожидания цены (секунды)
+DEFAULT_WAIT = 5.0   # для домена, по которому ещё нет статистики
+MIN_WAIT = 1.0
+MAX_WAIT = 10.0
+MIN_SAMPLES = 3      # сколько удачных парсингов нужно, чтобы доверять статистике
+
+# Скрипт в браузере: цена уже есть в DOM? Возвращает источник сигнала или false.
+PRICE_SIGNAL_JS = """
+(selectors) => {
+    for (const s of selectors) {
+        let el = null;
+        try { el = document.querySelector(s); } catch (e) { continue; }
+        if (el && /\\d/.test(el.textContent || '')) return 'selector';
+    }
+    if (document.querySelector('meta[property="og:price:amount"], meta[property="product:price:amount"]')) {
+        return 'og';
+    }
+    for (const s of document.querySelectorAll('script[type="application/ld+json"]')) {
+        if ((s.textContent || '').includes('"offers"')) return 'jsonld';
+    }
+    return false;
+}
+"""
+
+
+def wait_bound(domain: str) -> float:
+    """Верхний предел ожидания для домена, выученный по последним удачным парсингам."""
+    recent = metrics.samples("price_wait", domain)
+    if len(recent) < MIN_SAMPLES:
+        return DEFAULT_WAIT
+    return min(MAX_WAIT, max(MIN_WAIT, metrics.percentile(recent, 0.9) * 2 + 0.5))
+
+
+async def wait_for_price(page, domain: str, selectors: list):
+    """
+    Ждёт, пока на странице появится признак цены (селектор, JSON-LD offers или og:price),
+    но не дольше предела домена. Возвращает, сколько секунд ждали.
+    """
+    started = time.monotonic()
+    try:
+        await page.wait_for_function(
+            PRICE_SIGNAL_JS, arg=selectors, timeout=wait_bound(domain) * 1000, polling=100
+        )
+    except Exception:
+        # Таймаут — не ошибка: пробуем извлечь то, что успело загрузиться
+        pass
+    return time.monotonic() - started
+
+
+def record_time_to_price(domain: str, waited: float, total: float):
+    """Запоминает удачный замер: из 'price_wait' учится предел, 'time_to_price' — для отчёта."""
+    metrics.observe("price_wait", domain, waited)
+    metrics.observe("time_to_price", domain, total)
+    print(f"⏱ [PARSER] {domain}: цена за {total:.2f} c (ожидание {waited:.2f} c, "
+          f"новый предел {wait_bound(domain):.1f} c)")
@@ -0,0 +1,408 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from itertools import count
+
+from parser import metrics
+from parser.breaker import domain_guard
+from parser.proxies import proxy_pool
+from parser.pool import browser_pool, POOL_BROWSERS, POOL_CONTEXTS_PER_BROWSER
+
+# --- НАСТРОЙКИ ВОРКЕРОВ (можно переопределить через .env) ---
+# Сколько процессов-парсеров держать; 0 — парсить прямо в цикле бота (как раньше)
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", 1))
+# Сколько ссылок может ждать в очереди, прежде чем бот начнёт вежливо отказывать
+PARSER_QUEUE_SIZE = int(os.getenv("PARSER_QUEUE_SIZE", 20))
+# Один воркер одновременно ведёт столько задач, сколько страниц даёт его пул браузеров
+SLOTS_PER_WORKER = POOL_BROWSERS * POOL_CONTEXTS_PER_BROWSER
+JOB_TIMEOUT = 120          # сек на одну ссылку (включая запуск браузера)
+DEFAULT_JOB_SECONDS = 8.0  # стартовая оценка длительности парсинга для прогноза ожидания
+EWMA_ALPHA = 0.2
+WATCHDOG_EVERY = 5         # как часто проверять, живы ли воркеры (сек)
+QUEUE_NOTIFY_EVERY = 3     # как часто проверять, не сдвинулась ли очередь, чтобы обновить позицию (сек)
+STOP_TIMEOUT = 15          # сек на остановку воркера (закрыть браузеры), потом процесс убивается
+MAX_LINE = 1024 * 1024     # максимальный размер одной строки протокола (байт)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ParserQueueFull(Exception):
+    """Очередь парсинга заполнена — новую ссылку сейчас не берём."""
+
+
+def internal_error(reason: str) -> dict:
+    """
+    Ошибка на нашей стороне (свой таймаут задачи, очередь, перезапуск воркера), а не магазина или прокси:
+    флаг "internal" — предохранитель и оценка прокси такие ошибки не считают.
+    """
+    return {"error": f"Парсинг не удался: {reason}", "internal": True}
+
+
+class _Worker:
+    """Один процесс `python -m parser.workers` и задачи, которые он сейчас выполняет."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.proc = None
+        self.reader = None
+        self.running = {}   # id задачи -> (future, время старта, домен, прокси); пока ждём прокси — старт None
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    @property
+    def free_slots(self) -> int:
+        return SLOTS_PER_WORKER - len(self.running) if self.alive else 0
+
+
+class ParserWorkerPool:
+    """
+    Парсинг ссылок в отдельных процессах, чтобы Playwright не отнимал цикл событий
+    у остальных хендлеров бота. Задачи ждут в ограниченной очереди; воркеру задача
+    уходит, только когда у него есть свободная страница, а у её домена — свободный слот (domain_guard),
+    поэтому позиция в очереди честная, а ссылки одного магазина не обходят лимит очереди.
+    Прокси из общего пула (parser/proxies.py) задача получает тоже при выходе из очереди, и его оценку
+    пул обновляет по результату — ожидание в очереди не занимает прокси и не портит его замер скорости.
+    Обмен с воркером — строки JSON через stdin/stdout, метрики парсера приезжают вместе с результатом.
+    """
+
+    def __init__(self, workers: int = PARSER_WORKERS, queue_size: int = PARSER_QUEUE_SIZE):
+        self.workers_count = workers
+        self.queue_size = queue_size
+        self._workers = []
+        self._waiting = deque()   # (id, job, future)
+        self._ids = count(1)
+        self._partials = {}       # id -> on_partial
+        self._tasks = set()       # фоновые задачи (уведомления, прокси): держим ссылки, иначе их может собрать GC
+        self._avg_job = DEFAULT_JOB_SECONDS
+        self._watchdog = None
+        self._closing = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers_count > 0 and bool(self._workers)
+
+    @property
+    def total_slots(self) -> int:
+        return max(1, self.workers_count * SLOTS_PER_WORKER)
+
+    def estimate_wait(self, position: int) -> float:
+        """Примерное ожидание (сек) для задачи на позиции position (1 — следующая)."""
+        return (position / self.total_slots + 1) * self._avg_job
+
+    async def start(self):
+        if self.workers_count <= 0:
+            # Без воркеров браузеры живут прямо в процессе бота
+            await browser_pool.start()
+            return
+        self._closing = False
+        self._workers = [_Worker(i) for i in range(self.workers_count)]
+        for worker in self._workers:
+            await self._spawn(worker)
+        self._watchdog = asyncio.create_task(self._watch())
+        print(f"🧵 [PARSER] Воркеров: {self.workers_count}, страниц на воркер: {SLOTS_PER_WORKER}, "
+              f"очередь: {self.queue_size}")
+
+    async def stop(self):
+        if self.workers_count <= 0:
+            await browser_pool.stop()
+            return
+        self._closing = True
+        if self._watchdog:
+            self._watchdog.cancel()
+        while self._waiting:
+            _, _, future = self._waiting.popleft()
+            if not future.done():
+                future.set_result(internal_error("парсер остановлен"))
+        for worker in self._workers:
+            if worker.alive:
+                worker.proc.stdin.close()
+                try:
+                    await asyncio.wait_for(worker.proc.wait(), timeout=STOP_TIMEOUT)
+                except asyncio.TimeoutError:
+                    worker.proc.kill()
+            self._fail_running(worker, "Парсер остановлен")
+        self._workers = []
+
+    async def submit(self, url, domain, rules, allow, mode="http", on_queued=None, on_partial=None) -> dict:
+        """
+        Ставит ссылку в очередь и ждёт результат воркера.
+        Если свободной страницы нет, вызывает on_queued(позиция, ожидание_сек) — и снова, когда очередь
+        сдвинулась; если очередь уже полна — ParserQueueFull. on_partial получает карточку без цены,
+        если воркер её прислал.
+        """
+        if len(self._waiting) >= self.queue_size:
+            metrics.incr("queue_rejected", domain)
+            raise ParserQueueFull()
+
+        job_id = next(self._ids)
+        job = {"id": job_id, "url": url, "domain": domain, "rules": rules, "allow": list(allow), "mode": mode,
+               "partial": on_partial is not None, "proxy": None}
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((job_id, job, future))
+        if on_partial:
+            self._partials[job_id] = on_partial
+        self._dispatch()
+
+        position = self._position(job_id) if not future.done() else None
+        if position:
+            metrics.incr("queue_waited", domain)
+            await self._notify_queued(on_queued, position)
+
+        deadline = time.monotonic() + JOB_TIMEOUT + self.estimate_wait(self.queue_size)
+        try:
+            # Пока задача в очереди, просыпаемся раз в QUEUE_NOTIFY_EVERY сек и обновляем позицию
+            while position and on_queued:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future),
+                                                  timeout=min(QUEUE_NOTIFY_EVERY, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    if time.monotonic() >= deadline:
+                        raise
+                new_position = self._position(job_id)
+                if new_position and new_position != position:
+                    await self._notify_queued(on_queued, new_position)
+                position = new_position
+            return await asyncio.wait_for(asyncio.shield(future), timeout=max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._drop(job_id)
+            return internal_error("превышено время ожидания")
+        finally:
+            self._partials.pop(job_id, None)
+
+    def _position(self, job_id):
+        """Место задачи в очереди (1 — следующая) или None, если она уже у воркера."""
+        for position, entry in enumerate(self._waiting, 1):
+            if entry[0] == job_id:
+                return position
+        return None
+
+    async def _notify_queued(self, on_queued, position: int):
+        if not on_queued:
+            return
+        try:
+            await on_queued(position, self.estimate_wait(position))
+        except Exception as e:
+            print(f"⚠️ [PARSER] Не удалось сообщить позицию в очереди: {e}")
+
+    def _dispatch(self):
+        """
+        Раздаёт ожидающие задачи воркерам со свободными страницами. Задача домена, у которого
+        уже занят лимит страниц, остаётся на своём месте в очереди, а следующие за ней идут вперёд.
+        """
+        held = deque()
+        while self._waiting:
+            worker = max(self._workers, key=lambda w: w.free_slots, default=None)
+            if worker is None or worker.free_slots <= 0:
+                break
+            entry = self._waiting.popleft()
+            job_id, job, future = entry
+            if future.done():
+                continue
+            if not domain_guard.try_take(job["domain"]):
+                held.append(entry)
+                continue
+            # Страница воркера за задачей уже закреплена; отправим, как только будет прокси
+            worker.running[job_id] = (future, None, job["domain"], None)
+            self._background(self._start(worker, job_id, job))
+        self._waiting.extendleft(reversed(held))
+
+    async def _start(self, worker: _Worker, job_id, job):
+        """Берёт прокси для задачи, вышедшей из очереди, и отправляет её воркеру."""
+        proxy = await proxy_pool.acquire()
+        entry = worker.running.get(job_id)
+        if entry is None:
+            # Пока ждали прокси, задачу сняли (таймаут или воркер упал)
+            await self._return_proxy(proxy)
+            return
+        job["proxy"] = proxy.url if proxy else None
+        try:
+            worker.proc.stdin.write((json.dumps(job, ensure_ascii=False) + "\n").encode())
+        except (ConnectionResetError, BrokenPipeError) as e:
+            print(f"⚠️ [PARSER] Воркер {worker.index} недоступен: {e}")
+            self._finish(worker, job_id)
+            await self._return_proxy(proxy)
+            self._waiting.appendleft((job_id, job, entry[0]))
+            return
+        worker.running[job_id] = (entry[0], time.monotonic(), job["domain"], proxy)
+
+    def _finish(self, worker: _Worker, job_id):
+        """
+        Снимает задачу с воркера и освобождает слот её домена. Возвращает (future, время старта, прокси)
+        или (None, None, None). Прокси вернуть в пул — _return_proxy.
+        """
+        future, started, domain, proxy = worker.running.pop(job_id, (None, None, None, None))
+        if domain is not None:
+            domain_guard.give_back(domain)
+        return future, started, proxy
+
+    @staticmethod
+    async def _return_proxy(proxy, result=None, latency=None):
+        """Возвращает прокси в пул; с результатом — сначала обновляет его оценку."""
+        if proxy is None:
+            return
+        try:
+            if result is not None:
+                await proxy_pool.record_result(proxy, result, latency)
+        finally:
+            await proxy_pool.release(proxy)
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _drop(self, job_id):
+        self._waiting = deque(entry for entry in self._waiting if entry[0] != job_id)
+        for worker in self._workers:
+            _, _, proxy = self._finish(worker, job_id)
+            self._background(self._return_proxy(proxy))
+        self._dispatch()
+
+    async def _spawn(self, worker: _Worker):
+        worker.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "parser.workers",
+            cwd=PROJECT_ROOT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=MAX_LINE,
+        )
+        worker.reader = asyncio.create_task(self._read(worker))
+
+    async def _read(self, worker: _Worker):
+        """Читает ответы воркера: результат задачи и накопленные метрики."""
+        stream = worker.proc.stdout
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError as e:
+                print(f"⚠️ [PARSER] Слишком длинный ответ воркера {worker.index}: {e}")
+                continue
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            metrics.apply(message.get("metrics") or [])
+            if "partial" in message:
+                on_partial = self._partials.get(message.get("id"))
+                if on_partial:
+                    # Отдельной задачей: правка сообщения в Telegram не должна тормозить чтение ответов
+                    self._background(self._notify_partial(on_partial, message["partial"]))
+                continue
+            future, started, proxy = self._finish(worker, message.get("id"))
+            if future is not None:
+                result = message.get("result") or internal_error("пустой ответ парсера")
+                elapsed = time.monotonic() - started
+                self._avg_job += EWMA_ALPHA * (elapsed - self._avg_job)
+                if not future.done():
+                    future.set_result(result)
+                self._background(self._return_proxy(proxy, result, elapsed))
+            self._dispatch()
+
+    @staticmethod
+    async def _notify_partial(on_partial, data):
+        try:
+            await on_partial(data)
+        except Exception as e:
+            print(f"⚠️ [PARSER] Не удалось показать частичный результат: {e}")
+
+    def _fail_running(self, worker: _Worker, reason: str):
+        for job_id in list(worker.running):
+            future, _, proxy = self._finish(worker, job_id)
+            self._background(self._return_proxy(proxy))
+            if not future.done():
+                future.set_result(internal_error(reason))
+
+    async def _watch(self):
+        """Перезапускает упавшие воркеры; их текущие задачи завершаются ошибкой."""
+        while not self._closing:
+            await asyncio.sleep(WATCHDOG_EVERY)
+            for worker in self._workers:
+                if worker.alive or self._closing:
+                    continue
+                print(f"♻️ [PARSER] Воркер {worker.index} завершился (код {worker.proc.returncode}), перезапуск")
+                self._fail_running(worker, "процесс парсера перезапущен")
+                try:
+                    await self._spawn(worker)
+                except Exception as e:
+                    print(f"❌ [PARSER] Не удалось перезапустить воркер {worker.index}: {e}")
+            self._dispatch()
+
+
+parser_workers = ParserWorkerPool()
+
+
+# --- ПРОЦЕСС-ВОРКЕР ---
+
+async def _worker_main(out):
+    # Импорт здесь: engine сам импортирует этот модуль ради parser_workers
+    from parser.engine import parse_uncached
+    from parser.static import close_http_session
+
+    metrics.enable_forwarding()
+    try:
+        await browser_pool.start()
+    except Exception as e:
+        # Не падаем: статический путь работает и без браузера, а пул попробует стартовать на первой странице
+        print(f"❌ [PARSER] Воркер не смог прогреть браузеры: {e}")
+    write_lock = asyncio.Lock()
+    tasks = set()
+
+    async def send(message):
+        async with write_lock:
+            # Метрики забираем в момент ответа — всё, что накопилось к этому времени
+            message["metrics"] = metrics.drain()
+            out.write(json.dumps(message, ensure_ascii=False) + "\n")
+            out.flush()
+
+    async def run(job):
+        async def on_partial(data):
+            await send({"id": job["id"], "partial": data})
+
+        try:
+            result = await asyncio.wait_for(
+                parse_uncached(job["url"], job["domain"], job["rules"], job["allow"], job.get("mode", "http"),
+                               on_partial if job.get("partial") else None, job.get("proxy")),
+                timeout=JOB_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            # Свой предел на задачу (в него входит и ожидание страницы из пула) — не таймаут магазина
+            result = internal_error(f"задача дольше {JOB_TIMEOUT} c")
+        except Exception as e:
+            result = {"error": f"Парсинг не удался: {str(e) or type(e).__name__}"}
+        await send({"id": job["id"], "result": result})
+
+    try:
+        while True:
+            line = await asyncio.to_thread(sys.stdin.readline)
+            if not line:
+                break  # бот закрыл канал — выходим
+            try:
+                job = json.loads(line)
+            except ValueError:
+                continue
+            task = asyncio.create_task(run(job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # Бот останавливается и ждёт нас не дольше STOP_TIMEOUT: недоделанные задачи отменяем,
+        # чтобы успеть закрыть браузеры, а не быть убитыми вместе с ними
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await browser_pool.stop()
+        await close_http_session()
+
+
+if __name__ == "__main__":
+    # stdout занят протоколом: всё, что парсер печатает, уходит в stderr (в общий лог бота)
+    out = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+    asyncio.run(_worker_main(out))
@@ -0,0 +1,56 @@
+import unittest
+
+from parser.promo_text import scan_page
+
+# </head> в HTML5 необязателен — такая страница не должна «пропасть» целиком
+NO_HEAD_CLOSE = (
+    b'<html><head><title>Shop</title><body>'
+    b'<h1>Big SALE -30% today</h1>'
+    b'<ul><li><a href="/jacket">Trail Jacket -30%</a></li></ul>'
+    b'</body></html>'
+)
+
+
+class UnclosedHeadTest(unittest.TestCase):
+    def test_page_promo(self):
+        self.assertEqual(scan_page(NO_HEAD_CLOSE)[0], "Big SALE -30% today")
+
+    def test_entries(self):
+        _, entries = scan_page(NO_HEAD_CLOSE, base_url="https://shop.example/")
+        self.assertEqual([e["url"] for e in entries], ["https://shop.example/jacket"])
+        self.assertEqual(entries[0]["discount"], "-30%")
+
+    def test_title_is_not_promo(self):
+        self.assertIsNone(scan_page(b"<html><head><title>Summer SALE -50%</title></head><body>Hi</body></html>")[0])
+
+
+# Ссылки меню и подвала («Sale», «Outlet», «Terms of Sale») есть почти на каждой странице — это не акции
+SHOP_CHROME = (
+    b'<html><body><header><nav><ul><li><a href="/sale">Sale</a></li><li><a href="/outlet">Outlet</a></li>'
+    b'</ul></nav></header><main><ul>'
+    b'<li><a href="/jacket">Trail Jacket -30%</a></li>'
+    b'<li><a href="/boots">Boots SALE $89</a></li>'
+    b'<li><a href="/clearance">Clearance</a></li>'
+    b'</ul><article><header><h2><a href="/hat">Hat 20% off</a></h2></header></article></main>'
+    b'<footer><a href="/terms">Terms of Sale</a></footer></body></html>'
+)
+
+
+class MenuLinksTest(unittest.TestCase):
+    def test_menu_is_not_page_promo(self):
+        page = (b'<html><body><nav><a href="/sale">Sale</a> <a href="/outlet">Outlet -70%</a></nav>'
+                b'<h2>Sale</h2><p>New arrivals</p><footer>Terms of Sale</footer></body></html>')
+        self.assertIsNone(scan_page(page)[0])
+
+    def test_page_promo_needs_discount_or_price(self):
+        snippet, _ = scan_page(SHOP_CHROME)
+        self.assertEqual(snippet, "Trail Jacket -30%")
+
+    def test_menu_and_bare_keywords_are_not_entries(self):
+        _, entries = scan_page(SHOP_CHROME, base_url="https://shop.example/")
+        self.assertEqual([e["url"] for e in entries],
+                         ["https://shop.example/jacket", "https://shop.example/boots", "https://shop.example/hat"])
+
+
+if __name__ == "__main__":
+    unittest.main()